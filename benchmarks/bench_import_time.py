@@ -0,0 +1,87 @@
+"""
+Track start-up import time of the synthetic-data-generation entry point.
+
+Runs ``python -X importtime synthetic-data-generation --help`` ``--repeat``
+times in a fresh interpreter, reports the best total import time and the
+slowest top level imports of that run. Pass ``--budget-ms`` to fail when
+start-up gets slower, and ``--output`` to append the result to a CSV file
+so it can be tracked over time.
+
+    python benchmarks/bench_import_time.py --budget-ms 500
+"""
+import csv
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINT = os.path.join(ROOT, 'synthetic-data-generation')
+
+
+def import_times(args):
+    """
+    Run the entry point with ``-X importtime`` and parse its report.
+
+    Returns
+    -------
+    imports : list
+        List of (package, cumulative_us) for top level imports
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime',
+                             ENTRY_POINT, *args],
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True,
+                            cwd=ROOT,
+                            check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, package = line[len('import time:'):].split('|')
+        # nested imports are indented, their time is in their parent's
+        if not package[1:].startswith(' '):
+            imports.append((package.strip(), int(cumulative)))
+    return imports
+
+
+@click.command()
+@click.option('-r', '--repeat', default=5, show_default=True,
+              help='Number of interpreter start-ups, best one is reported')
+@click.option('-n', '--top', default=10, show_default=True,
+              help='Number of slowest top level imports to show')
+@click.option('--budget-ms', type=float, default=None,
+              help='Fail when the total import time exceeds this budget')
+@click.option('--output', type=click.Path(), default=None,
+              help='CSV file the result is appended to')
+@click.argument('args', nargs=-1)
+def main(repeat, top, budget_ms, output, args):
+    args = args or ('--help',)
+    runs = [import_times(args) for _ in range(repeat)]
+    best = min(runs, key=lambda imports: sum(us for _, us in imports))
+    total_ms = sum(us for _, us in best) / 1000
+
+    click.echo(f'{"import":<40}{"cumulative (ms)":>18}')
+    for package, us in sorted(best, key=lambda item: -item[1])[:top]:
+        click.echo(f'{package:<40}{us / 1000:>18.1f}')
+    click.echo(f'{"total":<40}{total_ms:>18.1f}')
+
+    if output is not None:
+        new_file = not os.path.exists(output)
+        with open(output, 'a', newline='') as stream:
+            writer = csv.writer(stream)
+            if new_file:
+                writer.writerow(['timestamp', 'args', 'total_ms'])
+            writer.writerow([datetime.now().isoformat(), ' '.join(args),
+                             f'{total_ms:.1f}'])
+
+    if budget_ms is not None and total_ms > budget_ms:
+        raise click.ClickException(f'Import time {total_ms:.1f} ms exceeds '
+                                   f'budget of {budget_ms:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Compare load time and memory of the SQL and Parquet input sources for the
+census test data.
+
+The SQL source configured in config.yaml is read once and written to a
+temporary Parquet file, then every source is read ``--repeat`` times in a
+fresh interpreter. Reported time is the best of the runs. Memory is the
+peak allocation traced by ``tracemalloc`` while reading plus the peak of
+Arrow's memory pool, which ``tracemalloc`` can not see, so it is an upper
+bound of the peak. Every source runs in its own interpreter so the Arrow
+pool peak belongs to that source alone. The deep size of the resulting
+DataFrame is reported next to it.
+
+    python benchmarks/bench_sources.py -c tests/config.yaml
+"""
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'synthetic-data-generation'))
+
+from configuration import load_config  # noqa: E402
+from sources import get_source, source_from_config  # noqa: E402
+
+
+def measure(source, repeat):
+    """
+    Read a source ``repeat`` times and measure time and memory, meant to
+    run in a fresh interpreter so the Arrow memory pool was not used by
+    another source.
+
+    Returns
+    -------
+    best_time, peak_bytes, frame_bytes : tuple
+    """
+    import pyarrow as pa
+
+    timings = []
+    peak = 0
+    df = None
+    for _ in range(repeat):
+        df = None
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        df = source.read()
+        timings.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    peak += pa.default_memory_pool().max_memory()
+    return min(timings), peak, int(df.memory_usage(deep=True).sum())
+
+
+def measure_in_subprocess(cfg, repeat, parquet=None):
+    """
+    Run ``measure`` for the SQL source of ``cfg``, or for a ``parquet``
+    file when given, in a fresh interpreter.
+
+    Returns
+    -------
+    best_time, peak_bytes, frame_bytes : tuple
+    """
+    args = [sys.executable, os.path.abspath(__file__), '-c', cfg,
+            '-r', str(repeat), '--measure', parquet or 'sql']
+    result = subprocess.run(args, stdout=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    return tuple(json.loads(result.stdout.splitlines()[-1]))
+
+
+@click.command()
+@click.option('-c', '--cfg',
+              required=True,
+              type=click.Path(exists=True),
+              default=os.path.join('tests', 'config.yaml'),
+              help='yaml type Config file with a SQL INPUT source')
+@click.option('-r', '--repeat', default=5, show_default=True,
+              help='Number of reads per source')
+@click.option('--measure', 'measure_source', default=None, hidden=True,
+              help='Measure a single source, "sql" or a Parquet file, and '
+                   'print the result as JSON')
+def main(cfg, repeat, measure_source):
+    config = load_config(cfg)
+    sql_source = source_from_config(config.input, config.smote.index_cat_col)
+    options = dict(dtypes=sql_source.dtypes,
+                   drop_cols=sql_source.drop_cols,
+                   columns=sql_source.columns)
+
+    if measure_source is not None:
+        source = (sql_source if measure_source == 'sql'
+                  else get_source(f'parquet://{measure_source}', **options))
+        click.echo(json.dumps(measure(source, repeat)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        parquet = os.path.join(tmp_dir, 'source.parquet')
+        sql_source.read().to_parquet(parquet, index=False)
+
+        click.echo(f"{'source':<10}{'best time (s)':>15}"
+                   f"{'peak alloc (MiB)':>20}{'frame (MiB)':>15}")
+        for name, path in (('sql', None), ('parquet', parquet)):
+            best, peak, frame = measure_in_subprocess(cfg, repeat, path)
+            click.echo(f'{name:<10}{best:>15.4f}'
+                       f'{peak / 2 ** 20:>20.2f}{frame / 2 ** 20:>15.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,196 +2,128 @@
 main.py
 ====================================
 The core module of Synthetic Data Generation
+
+Heavy dependencies (pandas, SQLAlchemy, sklearn, imblearn, matplotlib,
+seaborn) are imported by the stage that needs them, so ``--help`` and runs
+with reports switched off in the ``REPORTS`` section do not pay for them.
 """
 import logging
 import os
 from datetime import datetime
 
-import oyaml as yaml
-import pandas as pd
 import click
-from sqlalchemy import create_engine
 
-from smote import custom_smote
-from metadata import db_metadata
-from statistics import Statistics
-from constants import Constants
-from clustering import kmeans_cluster
-from utilities import save_to_excel
+from configuration import (load_config, load_configs, load_manifest,
+                           validate_schema)
+from exceptions import ConfigError, DeliveryError, SourceNotSupportedError
 
 
-def load_objects_file(file):
+def run(config, source):
     """
-    Read yaml file into a Dictionary.
+    Generate synthetic data and reports for one config.
 
     Parameters
     ----------
-    file : yaml file to load
-
-    Returns
-    -------
-    dict
+    config : configuration.Config
+    source : sources.Source
+        Input source of the config
     """
-    with open(file, 'r') as stream:
-        try:
-            return yaml.load(stream)
-        except yaml.YAMLError as exc:
-            print(exc)
-            raise
-
+    from pipeline import (configure_logging, generate_stage, load_stage,
+                          notify_stage, report_stage)
 
-def get_cat_codes_df(df):
-    """
-    Returns DataFrame containing only categorical columns
-    converted into numeric code, used for clustering
+    start = datetime.now()
+    configure_logging(config.output.log_file)
+    logging.info(f'Start Time: {start}')
+    logging.info(f'Present Working Directory: {os.getcwd()}')
+    logging.info(f'Config: {config.path}')
 
-    Parameters
-    ----------
-    df : pd.DataFrame
+    df = load_stage(config, source)
+    synth_df = generate_stage(config, df)
+    report_stage(config, df, synth_df)
+    if config.email is not None:
+        notify_stage(config)
 
-    Returns
-    -------
-    df_cat_codes : pd.DataFrame
-    """
-    df_cat_codes = pd.DataFrame()
-    for column, dtype in df.dtypes.to_dict().items():
-        if str(dtype) == 'category':
-            df_cat_codes[column] = df[column].cat.codes
-        elif str(dtype).startswith('int'):
-            df_cat_codes[column] = df[column]
-    return df_cat_codes
+    logging.info(f"Total Time Taken: {datetime.now() - start}")
 
 
-def read_sql(sql, con):
+def run_manifest(path):
     """
-    Read SQL query or database table into a DataFrame.
+    Run every config of a batch manifest on shared worker pools.
 
     Parameters
     ----------
-    sql : string or SQLAlchemy Selectable (select or text object)
-        SQL query to be executed or a table name.
-    con : SQLAlchemy connectable (engine/connection) or database string URI
-        or DBAPI2 connection (fallback mode)
-
-    Returns
-    -------
-    y : pd.DataFrame
+    path : str
+        yaml batch manifest
     """
     try:
-        y = pd.read_sql(sql, con).astype(config['SMOTE']['index_cat_col'])
-        logging.warning(f"Dropping columns {config['INPUT']['drop_cols']} "
-                        f"from DataFrame")
-        # TODO: do not drop any columns, use this as parameterized
-        #  convert them to numerical bin
-        y.drop(config['INPUT']['drop_cols'], axis='columns', inplace=True)
-        return y
-    except Exception as exception:
-        logging.error('%(exception)s')
-        raise exception
+        manifest = load_manifest(path)
+        from batch import run_batch
+        from pipeline import configure_logging
+        configure_logging(manifest.batch.log_file)
+        jobs = run_batch(manifest)
+    except (ConfigError, SourceNotSupportedError) as exception:
+        raise click.ClickException(str(exception))
+    failed = [job.name for job in jobs if job.failed]
+    if failed:
+        raise click.ClickException(f'Batch jobs failed: {failed}, see '
+                                   f'{manifest.batch.summary}')
 
 
 @click.command()
-@click.option('-c', '--cfg',
+@click.option('-c', '--cfg', 'cfgs',
               required=True,
+              multiple=True,
               type=click.Path(exists=True),
-              default=os.path.abspath(os.path.join(os.getcwd(),
-                                                   'tests',
-                                                   'config.yaml')),
+              default=[os.path.abspath(os.path.join(os.getcwd(),
+                                                    'tests',
+                                                    'config.yaml'))],
               help='yaml type Config file containing list of parameters for '
-                   'Synthetic data generation')
-def main(cfg):
-    global config
-    config = load_objects_file(cfg)
-    logging.basicConfig(format=Constants.LOG_FORMAT,
-                        filemode='w',
-                        filename=os.path.abspath(
-                            config['OUTPUT']['log_file']),
-                        level=logging.INFO)
-    logging.info(f'Start Time: {START}')
-    logging.info(f'Present Working Directory: {os.getcwd()}')
-
-    engine = create_engine(config['INPUT']['engine'])
-    logging.info("Generating DataFrame from sql, executing query "
-                 f"{config['INPUT']['sql']}; "
-                 f"on db {config['INPUT']['engine']}")
-    df = read_sql(config['INPUT']['sql'], engine)
-    df_cat_codes = get_cat_codes_df(df)
-
-    # TODO: Enable this only if input source is db, move it to module
-    # Get Database metadata in Excel
-    db_metadata(config['INPUT']['engine'],
-                config['OUTPUT']['db_metadata'])
-    logging.info(f"DB metadata excel output: "
-                 f"{os.path.abspath(config['OUTPUT']['db_metadata'])}")
-
-    # pre synthetic data generation, generate clusters
-    kmeans_cluster(df_cat_codes,
-                   config['CLUSTER']['X'],
-                   (config['OUTPUT']['cluster']))
-
-    # Get categorical columns index loc
-    cat_cols = [df.columns.get_loc(c)
-                for c, dtype in df.dtypes.to_dict().items()
-                if str(dtype) == 'category']
-
-    # Call smote algorithm for synthetic data generation
-    synth_df = custom_smote(df, cat_cols)
-
-    # TODO: write the synthetic output to desired data structure type
-    synth_df.to_excel(os.path.join(config['OUTPUT']['output_path'],
-                                   'synth_results.xlsx'))
-
-    # post synthetic data generation
-    synth_df_cat_codes = get_cat_codes_df(synth_df)
-    kmeans_cluster(synth_df_cat_codes,
-                   config['CLUSTER']['X'],
-                   (config['OUTPUT']['synth_cluster']))
-
-    # TEMP:
-    # getting statistics model and generating reports for input source
-    stats = Statistics(df)
-    logging.info(f"Statistics summary of input DataFrame:\n"
-                 f"{stats.describe.to_string()}")
-    stats.corr_heatmap(config['OUTPUT']['corr_heatmap'])
-    logging.info("Correlation heatmap output: "
-                 f"{os.path.abspath(config['OUTPUT']['corr_heatmap'])}")
-    stats.corr_pair_plot(config['OUTPUT']['corr_pair_plot'])
-    logging.info("Correlation pair plot output: "
-                 f"{os.path.abspath(config['OUTPUT']['corr_pair_plot'])}")
-
-    save_to_excel(output_xlsx=config['OUTPUT']['summary_excel'],
-                  dataframes={'Description': stats.describe,
-                              'Correlation': stats.corr,},
-                  images={'Pair Plot': config['OUTPUT']['corr_pair_plot'],
-                          'Heatmap': config['OUTPUT']['corr_heatmap'],
-                          'Cluster': config['OUTPUT']['cluster'], })
-    logging.info("Statistics summary excel output: "
-                 f"{os.path.abspath(config['OUTPUT']['summary_excel'])}")
-
-    # TEMP:
-    # getting statistics model and generating reports for input source
-    synth_stats = Statistics(synth_df)
-    logging.info("Statistics summary of Synthetic generated DataFrame:\n"
-                 f"{synth_stats.describe.to_string()}")
-    synth_stats.corr_heatmap(config['OUTPUT']['synth_corr_heatmap'])
-    logging.info("Correlation heatmap output: "
-                 f"{os.path.abspath(config['OUTPUT']['synth_corr_heatmap'])}")
-    synth_stats.corr_pair_plot(config['OUTPUT']['synth_corr_pair_plot'])
-    logging.info("Correlation heatmap output: "
-                 f"{os.path.abspath(config['OUTPUT']['synth_corr_pair_plot'])}")
-
-    save_to_excel(output_xlsx=config['OUTPUT']['synth_summary_excel'],
-                  dataframes={'Description': synth_stats.describe,
-                              'Correlation': synth_stats.corr, },
-                  images={'Pair Plot': config['OUTPUT']['synth_corr_pair_plot'],
-                          'Heatmap': config['OUTPUT']['synth_corr_heatmap'],
-                          'Cluster': config['OUTPUT']['synth_cluster'], })
-    logging.info("Statistics summary excel output: "
-                 f"{os.path.abspath(config['OUTPUT']['synth_summary_excel'])}")
-
-    logging.info(f"Total Time Taken: {datetime.now() - START}")
+                   'Synthetic data generation, repeat for a batch of '
+                   'configs')
+@click.option('--serve', 'serve_', is_flag=True,
+              help='Run the local generation service configured in the '
+                   'SERVICE section instead of a one-shot generation')
+@click.option('-m', '--manifest',
+              type=click.Path(exists=True),
+              default=None,
+              help='yaml type batch manifest listing configs to run on a '
+                   'shared worker pool, replaces --cfg')
+def main(cfgs, serve_, manifest):
+    if manifest is not None:
+        run_manifest(manifest)
+        return
+    try:
+        # validate every config before any expensive stage starts
+        configs = load_configs(cfgs)
+        from sources import source_from_config
+        sources = [source_from_config(config.input,
+                                      config.smote.index_cat_col)
+                   for config in configs]
+        for config, source in zip(configs, sources):
+            validate_schema(config, source)
+        if serve_:
+            from service import dataset_paths
+            dataset_paths(configs)
+    except (ConfigError, SourceNotSupportedError) as exception:
+        raise click.ClickException(str(exception))
+
+    if serve_:
+        from pipeline import configure_logging
+        from service import serve
+        configure_logging(configs[0].output.log_file)
+        serve(configs, load_config)
+        return
+
+    undelivered = []
+    for config, source in zip(configs, sources):
+        try:
+            run(config, source)
+        except DeliveryError as exception:
+            # the reports of the other configs are still generated
+            undelivered.append(f'{config.path}: {exception}')
+    if undelivered:
+        raise click.ClickException('\n'.join(undelivered))
 
 
 if __name__ == '__main__':
-    START = datetime.now()
     main()
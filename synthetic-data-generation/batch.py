@@ -0,0 +1,360 @@
+"""
+Batch runner for many configs listed in a manifest.
+
+All configs are validated before anything runs. Every config is a job of
+stages, ``load`` (and ``notify`` when reports are mailed) runs in a
+thread pool of the main process so SQLAlchemy engines and reflected
+metadata are shared by all jobs reading the same database, ``generate``
+and ``report`` run in a shared pool of worker processes. A stage is
+submitted as soon as the previous stage of its job is done, so stages of
+different datasets overlap and keep every worker busy. Failed stages are
+retried, a retried ``notify`` only mails the recipients the reports were
+not delivered to, and a timing summary of every stage is written at the end.
+"""
+import csv
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from concurrent.futures.process import BrokenProcessPool
+
+import pipeline
+from configuration import load_configs, validate_schema
+from constants import Constants
+from exceptions import DeliveryError
+from sources import source_from_config
+
+STAGES = ('load', 'generate', 'report', 'notify')
+# stages run in threads of the main process, the others in worker processes
+THREAD_STAGES = ('load', 'notify')
+
+
+class Job:
+    """
+    State and timings of the stages of one config.
+
+    Parameters
+    ----------
+    config : configuration.Config
+    source : sources.Source
+    """
+
+    def __init__(self, config, source):
+        self.config = config
+        self.source = source
+        self.df = None
+        self.synth_df = None
+        self.failed = False
+        self.attempts = {stage: 0 for stage in STAGES}
+        self.timings = []
+        # recipients the reports were mailed to, not mailed again on retry
+        self.delivered = set()
+
+    @property
+    def name(self):
+        return self.config.name
+
+    @property
+    def undelivered(self):
+        return [recipient for recipient in self.config.email.recipients
+                if recipient not in self.delivered]
+
+
+def _init_worker(memory_limit):
+    """
+    Limit the address space of a worker process, so a stage using too much
+    memory fails with MemoryError instead of taking the host down. The
+    limit is checked by ``configuration.load_manifest``.
+    """
+    if memory_limit is None:
+        return
+    import resource
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    return function(*args), time.perf_counter() - start
+
+
+class _ThreadFilter(logging.Filter):
+    """Passes the log records of the thread that created it."""
+
+    def __init__(self):
+        super().__init__()
+        self.thread = threading.get_ident()
+
+    def filter(self, record):
+        return record.thread == self.thread
+
+
+def _run_in_thread(stage, config, *args):
+    """
+    Run a pipeline stage in a thread of the main process. Log records of
+    the thread go to the job log as well as to the batch log.
+    """
+    handler = logging.FileHandler(config.output.log_file, mode='a')
+    handler.setFormatter(logging.Formatter(Constants.LOG_FORMAT))
+    handler.addFilter(_ThreadFilter())
+    root = logging.getLogger()
+    root.addHandler(handler)
+    try:
+        logging.info(f'Running {stage} of {config.path}')
+        return _timed(getattr(pipeline, f'{stage}_stage'), config, *args)
+    except Exception:
+        logging.exception(f'{stage} of {config.path} failed')
+        raise
+    finally:
+        root.removeHandler(handler)
+        handler.close()
+
+
+def _run_stage(stage, config, *args):
+    """
+    Run a pipeline stage in a worker process, logging to the job log.
+    """
+    pipeline.configure_logging(config.output.log_file, mode='a')
+    logging.info(f'Running {stage} of {config.path}')
+    try:
+        return _timed(getattr(pipeline, f'{stage}_stage'), config, *args)
+    except Exception:
+        logging.exception(f'{stage} of {config.path} failed')
+        raise
+
+
+class BatchRunner:
+    """
+    Schedules the stages of all jobs on a thread pool and a process pool.
+
+    A worker process dying breaks the whole process pool and fails every
+    stage running on it, so those failures are not counted against their
+    jobs. The pool is rebuilt and the interrupted stages are run again one
+    at a time on a single worker, where a crash is the stage's own.
+
+    Parameters
+    ----------
+    jobs : list
+        List of Job
+    batch : configuration.BatchConfig
+    """
+
+    def __init__(self, jobs, batch):
+        self.jobs = jobs
+        self.batch = batch
+        self.memory_limit = (None if batch.memory_limit_mb is None
+                             else int(batch.memory_limit_mb * 2 ** 20))
+        self.pending = {}
+        self.threads = None
+        self.processes = None
+        # single worker pool running interrupted stages one at a time
+        self.isolated = None
+        self.isolating = False
+        self.suspects = deque()
+
+    def _new_process_pool(self, workers=None):
+        # spawn, forking while loader threads run is not safe
+        return ProcessPoolExecutor(workers or self.batch.workers,
+                                   mp_context=multiprocessing.get_context(
+                                       'spawn'),
+                                   initializer=_init_worker,
+                                   initargs=(self.memory_limit,))
+
+    @staticmethod
+    def _stage_args(job, stage):
+        if stage == 'notify':
+            return (job.undelivered,)
+        return {'load': (job.source,),
+                'generate': (job.df,),
+                'report': (job.df, job.synth_df)}[stage]
+
+    def submit(self, job, stage, isolated=False):
+        job.attempts[stage] += 1
+        args = self._stage_args(job, stage)
+        if stage in THREAD_STAGES:
+            pool = self.threads
+            future = pool.submit(_run_in_thread, stage, job.config, *args)
+        else:
+            if isolated and self.isolated is None:
+                self.isolated = self._new_process_pool(1)
+            pool = self.isolated if isolated else self.processes
+            future = pool.submit(_run_stage, stage, job.config, *args)
+        self.pending[future] = (job, stage, time.perf_counter(), pool)
+
+    def complete(self, job, stage, result):
+        if stage == 'load':
+            job.df = result
+            self.submit(job, 'generate')
+        elif stage == 'generate':
+            job.synth_df = result
+            self.submit(job, 'report')
+        else:
+            job.df = job.synth_df = None
+            if stage == 'report' and job.config.email is not None:
+                self.submit(job, 'notify')
+            else:
+                logging.info(f'Job {job.name} done')
+
+    def run(self):
+        """
+        Run every job to completion or until its retries are used up.
+
+        Returns
+        -------
+        wall_time : float
+            Seconds the whole batch took
+        """
+        start = time.perf_counter()
+        self.threads = ThreadPoolExecutor(self.batch.io_workers)
+        self.processes = self._new_process_pool()
+        try:
+            for job in self.jobs:
+                self.submit(job, 'load')
+            while self.pending:
+                done, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._handle(future, start)
+        finally:
+            self.threads.shutdown()
+            self.processes.shutdown()
+            if self.isolated is not None:
+                self.isolated.shutdown()
+        return time.perf_counter() - start
+
+    def _isolate_next(self):
+        if self.isolating or not self.suspects:
+            return
+        job, stage = self.suspects.popleft()
+        logging.warning(f'Running {stage} of {job.name} alone after a '
+                        f'worker crash')
+        self.isolating = True
+        self.submit(job, stage, isolated=True)
+
+    def _handle(self, future, batch_start):
+        job, stage, submitted, pool = self.pending.pop(future)
+        isolated = pool is self.isolated
+        finished = time.perf_counter()
+        try:
+            result, run_time = future.result()
+        except Exception as exception:
+            crashed = isinstance(exception, BrokenProcessPool)
+            if crashed and isolated:
+                logging.error(f'Worker process died running {stage} of '
+                              f'{job.name}')
+                self.isolated.shutdown(wait=False)
+                self.isolated = self._new_process_pool(1)
+            elif crashed:
+                if pool is self.processes:
+                    logging.error('Worker process died, restarting process '
+                                  'pool')
+                    self.processes.shutdown(wait=False)
+                    self.processes = self._new_process_pool()
+                # any stage running on the pool fails, which one crashed it
+                # is only known once it runs alone
+                self._record(job, stage, 'interrupted', submitted, finished,
+                             None, batch_start, exception)
+                job.attempts[stage] -= 1
+                self.suspects.append((job, stage))
+                self._isolate_next()
+                return
+            self._record(job, stage, 'failed', submitted, finished,
+                         None, batch_start, exception)
+            if isinstance(exception, DeliveryError):
+                job.delivered.update(exception.delivered)
+            if job.attempts[stage] <= self.batch.retries:
+                logging.warning(f'Retrying {stage} of {job.name} after '
+                                f'{type(exception).__name__}: {exception}')
+                self.submit(job, stage, isolated=isolated)
+                return
+            logging.error(f'Job {job.name} failed in {stage}: {exception}')
+            job.failed = True
+            job.df = job.synth_df = None
+        else:
+            self._record(job, stage, 'done', submitted, finished, run_time,
+                         batch_start)
+            self.complete(job, stage, result)
+        if isolated:
+            self.isolating = False
+            self._isolate_next()
+
+    @staticmethod
+    def _record(job, stage, status, submitted, finished, run_time,
+                batch_start, exception=None):
+        job.timings.append({
+            'config': job.config.path,
+            'stage': stage,
+            'attempt': job.attempts[stage],
+            'status': status,
+            'submitted_s': round(submitted - batch_start, 3),
+            'finished_s': round(finished - batch_start, 3),
+            'run_s': None if run_time is None else round(run_time, 3),
+            'error': '' if exception is None
+            else f'{type(exception).__name__}: {exception}'})
+
+
+def write_summary(jobs, wall_time, summary_csv):
+    """
+    Write the timing of every stage attempt to a csv file and log the
+    totals.
+
+    Parameters
+    ----------
+    jobs : list
+        List of Job
+    wall_time : float
+        Seconds the whole batch took
+    summary_csv : str
+        Output csv path
+    """
+    rows = [timing for job in jobs for timing in job.timings]
+    with open(summary_csv, 'w', newline='') as stream:
+        writer = csv.DictWriter(stream, fieldnames=['config', 'stage',
+                                                    'attempt', 'status',
+                                                    'submitted_s',
+                                                    'finished_s', 'run_s',
+                                                    'error'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    busy = sum(row['run_s'] or 0 for row in rows)
+    logging.info(f'Batch of {len(jobs)} configs took {wall_time:.2f}s, '
+                 f'{busy:.2f}s of stage work, '
+                 f'{sum(job.failed for job in jobs)} failed')
+    for job in jobs:
+        stages = ', '.join(f"{row['stage']} {row['run_s']}s"
+                           for row in job.timings if row['status'] == 'done')
+        logging.info(f"{job.name}: {'failed' if job.failed else 'done'} "
+                     f"({stages})")
+    logging.info(f'Batch timing summary: {summary_csv}')
+
+
+def run_batch(manifest):
+    """
+    Validate and run every config of a manifest.
+
+    Parameters
+    ----------
+    manifest : configuration.Manifest
+
+    Returns
+    -------
+    jobs : list
+        List of Job, check ``Job.failed``
+    """
+    configs = load_configs(manifest.configs)
+    sources = [source_from_config(config.input, config.smote.index_cat_col)
+               for config in configs]
+    for config, source in zip(configs, sources):
+        validate_schema(config, source)
+
+    jobs = [Job(config, source) for config, source in zip(configs, sources)]
+    for job in jobs:
+        # stages append to the job log
+        open(job.config.output.log_file, 'w').close()
+    logging.info(f'Running batch of {len(jobs)} configs from '
+                 f'{manifest.path}')
+    wall_time = BatchRunner(jobs, manifest.batch).run()
+    write_summary(jobs, wall_time, manifest.batch.summary)
+    return jobs
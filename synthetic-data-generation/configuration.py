@@ -0,0 +1,505 @@
+"""
+Typed config model for Synthetic Data Generation.
+
+Config files are parsed with a safe YAML loader. Besides plain YAML and
+anchors, two tags are understood to build paths:
+
+    !join [*output_path, 'log.out']
+    !!python/object/apply:os.path.join [*output_path, 'log.out']
+
+the latter only for existing configs, no other python tag is constructed.
+Values only referenced through anchors are defined in a free-form
+``VARS`` section, every other section is checked against its model.
+Every section is checked once when the file is loaded, unknown keys,
+missing keys and wrong types are all reported together, and output paths
+are resolved to absolute paths up front. Loaded configs are cached by
+file modification time and content hash.
+"""
+import hashlib
+import os
+import typing
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import oyaml as yaml
+
+from exceptions import ConfigError
+
+PATH_JOIN_TAGS = ('!join',
+                  'tag:yaml.org,2002:python/object/apply:os.path.join')
+
+
+class ConfigLoader(yaml.SafeLoader):
+    """
+    Safe YAML loader with path join tags.
+    """
+
+
+def _construct_join(loader, node):
+    return os.path.join(*[str(part)
+                          for part in loader.construct_sequence(node,
+                                                                deep=True)])
+
+
+for _tag in PATH_JOIN_TAGS:
+    ConfigLoader.add_constructor(_tag, _construct_join)
+
+
+class InputConfig(NamedTuple):
+    """``INPUT`` section, see ``sources.get_source`` for ``source`` URIs."""
+    source: Optional[str] = None
+    sql: Optional[str] = None
+    drop_cols: Tuple[str, ...] = ()
+    columns: Optional[Tuple[str, ...]] = None
+    chunksize: Optional[int] = None
+    # dataset name used by the service, config file name by default
+    name: Optional[str] = None
+    # legacy alias of source
+    engine: Optional[str] = None
+
+
+class OutputConfig(NamedTuple):
+    """
+    ``OUTPUT`` section, paths left out default to a file in ``output_path``.
+    """
+    output_path: str
+    log_file: str = 'log.out'
+    db_metadata: str = 'db_metadata.xlsx'
+    synth_results: str = 'synth_results.xlsx'
+    corr_heatmap: str = 'heatmap.png'
+    corr_pair_plot: str = 'pair_plot.png'
+    summary_excel: str = 'summary.xlsx'
+    synth_corr_heatmap: str = 'synth_heatmap.png'
+    synth_corr_pair_plot: str = 'synth_pair_plot.png'
+    synth_summary_excel: str = 'synth_summary.xlsx'
+    dendrogram: str = 'dendrogram.png'
+    cluster: str = 'cluster.png'
+    synth_dendrogram: str = 'synth_dendrogram.png'
+    synth_cluster: str = 'synth_cluster.png'
+
+
+class ClusterConfig(NamedTuple):
+    """``CLUSTER`` section."""
+    X: Tuple[str, ...]
+
+
+class SmoteConfig(NamedTuple):
+    """``SMOTE`` section, see ``smote.conditional_smote`` for ``strata``."""
+    index_cat_col: Dict[str, str]
+    k_neighbors: int = 6
+    strata: Tuple[dict, ...] = ()
+
+
+class ReportsConfig(NamedTuple):
+    """``REPORTS`` section, report stages to run."""
+    db_metadata: bool = True
+    cluster: bool = True
+    statistics: bool = True
+
+
+class ServiceConfig(NamedTuple):
+    """``SERVICE`` section, see ``service.serve``."""
+    host: str = '127.0.0.1'
+    port: int = 8765
+    socket: Optional[str] = None
+    max_concurrency: int = 4
+    memory_budget_mb: float = 1024
+    chunk_rows: int = 10000
+    workers: Optional[int] = None
+    datasets: Dict[str, str] = {}
+
+
+class EmailConfig(NamedTuple):
+    """
+    ``EMAIL`` section, reports are mailed to every recipient when present,
+    see ``pipeline.notify_stage``.
+    """
+    host: str
+    sender: str
+    recipients: Tuple[str, ...]
+    port: int = 587
+    username: Optional[str] = None
+    # environment variable holding the SMTP password
+    password_env: Optional[str] = None
+    starttls: bool = True
+    subject: str = 'Synthetic data generation reports'
+    message: str = 'Synthetic data generation reports are attached.'
+    # OUTPUT keys of the files attached to the email
+    attachments: Tuple[str, ...] = ('summary_excel', 'synth_summary_excel')
+    # SMTP sessions, and emails sent at a time
+    pool_size: int = 4
+    batch_size: int = 100
+
+
+class Config(NamedTuple):
+    """Validated config file."""
+    path: str
+    input: InputConfig
+    output: OutputConfig
+    cluster: ClusterConfig
+    smote: SmoteConfig
+    reports: ReportsConfig = ReportsConfig()
+    service: ServiceConfig = ServiceConfig()
+    email: Optional[EmailConfig] = None
+
+    @property
+    def name(self):
+        """Dataset name, ``INPUT.name`` or the config file name."""
+        return self.input.name or os.path.splitext(
+            os.path.basename(self.path))[0]
+
+
+class BatchConfig(NamedTuple):
+    """
+    ``BATCH`` section of a batch manifest, see ``batch.run_batch``. Paths
+    left out default to a file in ``output_path``.
+    """
+    output_path: str
+    log_file: str = 'batch.log'
+    summary: str = 'batch_summary.csv'
+    # worker processes for generate and report stages, cpu count by default
+    workers: Optional[int] = None
+    # threads loading input sources
+    io_workers: int = 4
+    # attempts after the first failure of a stage
+    retries: int = 1
+    # address space limit of every worker process, unlimited by default
+    memory_limit_mb: Optional[float] = None
+
+
+class Manifest(NamedTuple):
+    """Validated batch manifest."""
+    path: str
+    batch: BatchConfig
+    configs: Tuple[str, ...]
+
+
+SECTIONS = {'INPUT': ('input', InputConfig),
+            'OUTPUT': ('output', OutputConfig),
+            'CLUSTER': ('cluster', ClusterConfig),
+            'SMOTE': ('smote', SmoteConfig),
+            'REPORTS': ('reports', ReportsConfig),
+            'SERVICE': ('service', ServiceConfig),
+            'EMAIL': ('email', EmailConfig)}
+
+# section holding values only referenced through anchors, not validated
+VARS_SECTION = 'VARS'
+
+STRATUM_KEYS = {'name': str, 'query': str, 'rows': int}
+
+_CACHE = {}
+
+
+def _check_type(value, annotation):
+    """
+    Returns value converted to the annotated type, lists become tuples,
+    raises TypeError when it does not fit.
+    """
+    origin = getattr(annotation, '__origin__', None)
+    args = getattr(annotation, '__args__', ())
+    if origin is typing.Union:
+        if value is None and type(None) in args:
+            return None
+        return _check_type(value, [arg for arg in args
+                                   if arg is not type(None)][0])
+    if origin is tuple:
+        if not isinstance(value, (list, tuple)):
+            raise TypeError(f'expecting a list, got {value!r}')
+        return tuple(_check_type(item, args[0]) for item in value)
+    if origin is dict:
+        if not isinstance(value, dict):
+            raise TypeError(f'expecting a mapping, got {value!r}')
+        return {_check_type(key, args[0]): _check_type(item, args[1])
+                for key, item in value.items()}
+    if annotation is float and isinstance(value, int) \
+            and not isinstance(value, bool):
+        return float(value)
+    if annotation is int and isinstance(value, bool) \
+            or not isinstance(value, annotation):
+        raise TypeError(f'expecting {annotation.__name__}, got {value!r}')
+    return value
+
+
+def _build_section(section, section_class, data, errors):
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        errors.append(f'{section}: expecting a mapping, got {data!r}')
+        return None
+    hints = typing.get_type_hints(section_class)
+    values = {}
+    for key, value in data.items():
+        if key not in hints:
+            errors.append(f'{section}.{key}: unknown key')
+            continue
+        try:
+            values[key] = _check_type(value, hints[key])
+        except TypeError as exception:
+            errors.append(f'{section}.{key}: {exception}')
+    missing = [key for key in section_class._fields
+               if key not in section_class._field_defaults
+               and key not in data]
+    errors.extend(f'{section}.{key}: missing key' for key in missing)
+    if missing or len(values) != len(data):
+        return None
+    return section_class(**values)
+
+
+def _check_strata(strata, errors):
+    for index, stratum in enumerate(strata):
+        prefix = f'SMOTE.strata[{index}]'
+        if not isinstance(stratum, dict):
+            errors.append(f'{prefix}: expecting a mapping, got {stratum!r}')
+            continue
+        for key, value in stratum.items():
+            if key not in STRATUM_KEYS:
+                errors.append(f'{prefix}.{key}: unknown key')
+            elif not isinstance(value, STRATUM_KEYS[key]) \
+                    or isinstance(value, bool):
+                errors.append(f'{prefix}.{key}: expecting '
+                              f'{STRATUM_KEYS[key].__name__}, got {value!r}')
+        if isinstance(stratum.get('rows'), int) and stratum['rows'] < 0:
+            errors.append(f'{prefix}.rows: must not be negative')
+
+
+def parse_config(content, path):
+    """
+    Parse and validate config file content.
+
+    Parameters
+    ----------
+    content : str or bytes
+        YAML document
+    path : str
+        Config file path, used for messages and the dataset name
+
+    Returns
+    -------
+    config : Config
+
+    Raises
+    ------
+    ConfigError
+        When the document is not valid YAML or does not fit the model
+    """
+    try:
+        data = yaml.load(content, Loader=ConfigLoader)
+    except yaml.YAMLError as exception:
+        raise ConfigError(f'{path}: {exception}') from exception
+    if not isinstance(data, dict):
+        raise ConfigError(f'{path}: expecting a mapping of sections')
+
+    errors = [f'{section}: unknown section'
+              for section in data
+              if section not in SECTIONS and section != VARS_SECTION]
+    sections = {}
+    for section, (field, section_class) in SECTIONS.items():
+        if section not in data \
+                and field not in Config._field_defaults:
+            errors.append(f'{section}: missing section')
+            continue
+        if section in data:
+            sections[field] = _build_section(section, section_class,
+                                             data[section], errors)
+
+    input_config = sections.get('input')
+    if input_config is not None:
+        if input_config.source is None and input_config.engine is None:
+            errors.append('INPUT.source: missing key')
+        sections['input'] = input_config._replace(
+            source=input_config.source or input_config.engine)
+    output_config = sections.get('output')
+    if output_config is not None:
+        # precompile all output paths once, file names left out are placed
+        # in output_path
+        output_path = os.path.abspath(output_config.output_path)
+        sections['output'] = OutputConfig(output_path, *[
+            os.path.abspath(value if field in data['OUTPUT']
+                            else os.path.join(output_path, value))
+            for field, value in zip(OutputConfig._fields[1:],
+                                    output_config[1:])])
+    if sections.get('cluster') is not None \
+            and len(sections['cluster'].X) < 2:
+        errors.append('CLUSTER.X: expecting at least two columns')
+    if sections.get('email') is not None:
+        errors.extend(f'EMAIL.attachments: {name} is not an OUTPUT key'
+                      for name in sections['email'].attachments
+                      if name not in OutputConfig._fields)
+        if sections['email'].pool_size < 1:
+            errors.append('EMAIL.pool_size: must be at least 1')
+    if sections.get('smote') is not None:
+        _check_strata(sections['smote'].strata, errors)
+        if sections['smote'].k_neighbors < 1:
+            errors.append('SMOTE.k_neighbors: must be at least 1')
+
+    if errors:
+        raise ConfigError(f'Invalid config {path}:\n  '
+                          + '\n  '.join(errors))
+    return Config(path=path, **sections)
+
+
+def _check_memory_limit(memory_limit_mb, errors):
+    """
+    Check ``BATCH.memory_limit_mb`` can be applied to worker processes on
+    this platform, see ``batch._init_worker``.
+    """
+    if memory_limit_mb <= 0:
+        errors.append('BATCH.memory_limit_mb: must be positive')
+        return
+    try:
+        import resource
+    except ImportError:
+        errors.append('BATCH.memory_limit_mb: memory limits are not '
+                      'supported on this platform, leave it out')
+        return
+    hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+    if hard != resource.RLIM_INFINITY \
+            and memory_limit_mb * 2 ** 20 > hard:
+        errors.append(f'BATCH.memory_limit_mb: above the address space '
+                      f'limit of {hard / 2 ** 20:.0f} MiB of this process')
+
+
+def load_manifest(path):
+    """
+    Load and validate a batch manifest, a ``BATCH`` section and the list of
+    ``CONFIGS`` files to run.
+
+    Parameters
+    ----------
+    path : str
+        yaml manifest file
+
+    Returns
+    -------
+    manifest : Manifest
+    """
+    path = os.path.abspath(path)
+    try:
+        with open(path, 'rb') as stream:
+            data = yaml.load(stream, Loader=ConfigLoader)
+    except yaml.YAMLError as exception:
+        raise ConfigError(f'{path}: {exception}') from exception
+    if not isinstance(data, dict):
+        raise ConfigError(f'{path}: expecting a mapping of sections')
+
+    errors = [f'{section}: unknown section'
+              for section in data if section not in ('BATCH', 'CONFIGS')]
+    batch = _build_section('BATCH', BatchConfig, data.get('BATCH'), errors)
+    try:
+        configs = _check_type(data.get('CONFIGS'), Tuple[str, ...])
+        if not configs:
+            errors.append('CONFIGS: expecting at least one config file')
+    except TypeError as exception:
+        errors.append(f'CONFIGS: {exception}')
+    if batch is not None:
+        if batch.retries < 0:
+            errors.append('BATCH.retries: must not be negative')
+        if batch.memory_limit_mb is not None:
+            _check_memory_limit(batch.memory_limit_mb, errors)
+        output_path = os.path.abspath(batch.output_path)
+        batch = batch._replace(output_path=output_path, **{
+            field: os.path.abspath(
+                getattr(batch, field) if field in data['BATCH']
+                else os.path.join(output_path, getattr(batch, field)))
+            for field in ('log_file', 'summary')})
+
+    if errors:
+        raise ConfigError(f'Invalid manifest {path}:\n  '
+                          + '\n  '.join(errors))
+    return Manifest(path=path, batch=batch,
+                    configs=tuple(os.path.abspath(config)
+                                  for config in configs))
+
+
+def load_config(path):
+    """
+    Load and validate a config file. Configs are cached, the file is only
+    parsed again when its modification time or size changed and its
+    content hash differs.
+
+    Parameters
+    ----------
+    path : str
+        yaml config file
+
+    Returns
+    -------
+    config : Config
+    """
+    path = os.path.abspath(path)
+    # relative output paths resolve against the working directory
+    key = (path, os.getcwd())
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _CACHE.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[2]
+
+    with open(path, 'rb') as stream:
+        content = stream.read()
+    digest = hashlib.sha256(content).hexdigest()
+    if cached is not None and cached[1] == digest:
+        config = cached[2]
+    else:
+        config = parse_config(content, path)
+    _CACHE[key] = (signature, digest, config)
+    return config
+
+
+def load_configs(paths):
+    """
+    Load and validate several config files, reporting the errors of all of
+    them together.
+
+    Parameters
+    ----------
+    paths : list
+
+    Returns
+    -------
+    configs : list
+    """
+    configs, errors = [], []
+    for path in paths:
+        try:
+            configs.append(load_config(path))
+        except ConfigError as exception:
+            errors.append(str(exception))
+    if errors:
+        raise ConfigError('\n'.join(errors))
+    return configs
+
+
+def validate_schema(config, source):
+    """
+    Check the input source can be opened and the columns used by
+    ``INPUT.columns``, ``CLUSTER.X`` and ``SMOTE.index_cat_col`` exist in
+    it, without reading any rows.
+
+    Parameters
+    ----------
+    config : Config
+    source : sources.Source
+
+    Raises
+    ------
+    ConfigError
+    """
+    try:
+        available = source.available_columns()
+    except Exception as exception:
+        raise ConfigError(f'Invalid config {config.path}:\n  INPUT.source: '
+                          f'can not read columns of {source}: '
+                          f'{exception}') from exception
+    errors = [f'INPUT.columns: column {column} not in input {source}'
+              for column in source.columns or ()
+              if column not in available]
+    columns = set(source.columns or available) - set(source.drop_cols)
+    errors.extend(f'CLUSTER.X: column {column} not in input {source}'
+                  for column in config.cluster.X if column not in columns)
+    errors.extend(f'SMOTE.index_cat_col: column {column} not in input '
+                  f'{source}'
+                  for column in config.smote.index_cat_col
+                  if column not in columns)
+    if errors:
+        raise ConfigError(f'Invalid config {config.path}:\n  '
+                          + '\n  '.join(errors))
@@ -0,0 +1,34 @@
+class SyntheticDataError(Exception):
+    """Base class for errors raised by Synthetic Data Generation."""
+
+
+class SourceNotSupportedError(SyntheticDataError, ValueError):
+    """Input source URI does not map to any known source."""
+
+
+class EmptyStratumError(SyntheticDataError, ValueError):
+    """No input rows match the filter of a requested stratum."""
+
+
+class ConfigError(SyntheticDataError, ValueError):
+    """Config file is not valid YAML or does not fit the config model."""
+
+
+class DeliveryError(SyntheticDataError):
+    """
+    Reports could not be mailed to some of the recipients.
+
+    Parameters
+    ----------
+    message : str
+    failed : dict
+        Refused recipients or the exception raised mailing them, keyed by
+        recipient
+    delivered : tuple
+        Recipients the reports were mailed to
+    """
+
+    def __init__(self, message, failed=None, delivered=()):
+        super().__init__(message)
+        self.failed = dict(failed or {})
+        self.delivered = tuple(delivered)
@@ -1,10 +1,37 @@
 import logging
+import threading
 
 import pandas as pd
 import openpyxl
 import sqlalchemy
 
 from constants import Constants
+from sources import get_engine
+
+_METADATA = {}
+_METADATA_LOCK = threading.Lock()
+
+
+def reflect(conn):
+    """
+    Returns the reflected metadata of a database, reflected once per
+    process and shared by every config reading the same database.
+
+    Parameters
+    ----------
+    conn : str
+        SQLAlchemy database URI
+
+    Returns
+    -------
+    metadata : sqlalchemy.MetaData
+    """
+    with _METADATA_LOCK:
+        if conn not in _METADATA:
+            metadata = sqlalchemy.MetaData()
+            metadata.reflect(bind=get_engine(conn))
+            _METADATA[conn] = metadata
+        return _METADATA[conn]
 
 
 class UserMetadata:
@@ -26,9 +53,7 @@ class to get metadata from any database
     """
 
     def __init__(self, conn):
-        self.__engine = sqlalchemy.create_engine(conn)
-        self.__metadata = sqlalchemy.MetaData()
-        self.__metadata.reflect(bind=self.__engine)
+        self.__metadata = reflect(conn)
 
     def get_tables(self):
         """
@@ -0,0 +1,231 @@
+"""
+Stages of a synthetic data generation run for one config. The CLI runs
+them one after the other, the batch runner schedules them across
+datasets, loading in threads and generating and reporting in worker
+processes.
+"""
+import logging
+import os
+
+from constants import Constants
+from exceptions import DeliveryError
+from sources import SqlSource
+
+
+def configure_logging(log_file, mode='w'):
+    """
+    Send the root logger to a new log file, replacing previous handlers so
+    every config of a batch gets its own log.
+
+    Parameters
+    ----------
+    log_file : str
+    mode : str
+        ``a`` to append to the log of an earlier stage
+    """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    handler = logging.FileHandler(log_file, mode=mode)
+    handler.setFormatter(logging.Formatter(Constants.LOG_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+
+def write_statistics(df, label, heatmap, pair_plot, summary_excel,
+                     cluster=None):
+    """
+    Writes statistics, correlation heatmap, correlation pair plot and
+    summary excel of a DataFrame.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+    label : str
+        Name of the DataFrame used in the logs
+    heatmap : str
+        Heatmap image file path
+    pair_plot : str
+        Pair plot image file path
+    summary_excel : str
+        Summary excel file path
+    cluster : str, optional
+        Cluster image file path added to the summary excel
+    """
+    from statistics import Statistics
+    from utilities import save_to_excel
+
+    # getting statistics model and generating reports
+    stats = Statistics(df)
+    logging.info(f"Statistics summary of {label} DataFrame:\n"
+                 f"{stats.describe.to_string()}")
+    stats.corr_heatmap(heatmap)
+    logging.info(f"Correlation heatmap output: {os.path.abspath(heatmap)}")
+    stats.corr_pair_plot(pair_plot)
+    logging.info("Correlation pair plot output: "
+                 f"{os.path.abspath(pair_plot)}")
+
+    images = {'Pair Plot': pair_plot,
+              'Heatmap': heatmap, }
+    if cluster is not None:
+        images['Cluster'] = cluster
+    save_to_excel(output_xlsx=summary_excel,
+                  dataframes={'Description': stats.describe,
+                              'Correlation': stats.corr, },
+                  images=images)
+    logging.info("Statistics summary excel output: "
+                 f"{os.path.abspath(summary_excel)}")
+
+
+def load_stage(config, source):
+    """
+    Read the input source and write database metadata.
+
+    Parameters
+    ----------
+    config : configuration.Config
+    source : sources.Source
+
+    Returns
+    -------
+    df : pd.DataFrame
+    """
+    df = source.read()
+
+    # Get Database metadata in Excel
+    if config.reports.db_metadata and isinstance(source, SqlSource):
+        from metadata import db_metadata
+        db_metadata(source.location, config.output.db_metadata)
+        logging.info(f"DB metadata excel output: "
+                     f"{config.output.db_metadata}")
+    return df
+
+
+def generate_stage(config, df):
+    """
+    Generate synthetic data and write it to ``OUTPUT.synth_results``.
+
+    Parameters
+    ----------
+    config : configuration.Config
+    df : pd.DataFrame
+
+    Returns
+    -------
+    synth_df : pd.DataFrame
+    """
+    # Call smote algorithm for synthetic data generation, only for the
+    # requested strata when quotas are configured
+    if config.smote.strata:
+        from smote import conditional_smote
+        synth_df = conditional_smote(df, config.smote.strata,
+                                     config.smote.k_neighbors)
+    else:
+        from smote import custom_smote
+        # Get categorical columns index loc
+        cat_cols = [df.columns.get_loc(c)
+                    for c, dtype in df.dtypes.to_dict().items()
+                    if str(dtype) == 'category']
+        synth_df = custom_smote(df, cat_cols, config.smote.k_neighbors)
+
+    # TODO: write the synthetic output to desired data structure type
+    synth_df.to_excel(config.output.synth_results)
+    return synth_df
+
+
+def report_stage(config, df, synth_df):
+    """
+    Write clusters and statistics reports of input and synthetic data.
+
+    Parameters
+    ----------
+    config : configuration.Config
+    df : pd.DataFrame
+    synth_df : pd.DataFrame
+    """
+    output, reports = config.output, config.reports
+    if reports.cluster:
+        from clustering import kmeans_cluster
+        from utilities import get_cat_codes_df
+        kmeans_cluster(get_cat_codes_df(df), list(config.cluster.X),
+                       output.cluster)
+        kmeans_cluster(get_cat_codes_df(synth_df), list(config.cluster.X),
+                       output.synth_cluster)
+
+    if reports.statistics:
+        write_statistics(df, 'input',
+                         heatmap=output.corr_heatmap,
+                         pair_plot=output.corr_pair_plot,
+                         summary_excel=output.summary_excel,
+                         cluster=output.cluster if reports.cluster else None)
+        write_statistics(synth_df, 'Synthetic generated',
+                         heatmap=output.synth_corr_heatmap,
+                         pair_plot=output.synth_corr_pair_plot,
+                         summary_excel=output.synth_summary_excel,
+                         cluster=(output.synth_cluster
+                                  if reports.cluster else None))
+
+
+def notify_stage(config, recipients=None):
+    """
+    Mail the reports listed in ``EMAIL.attachments`` to every recipient,
+    one email per recipient sent concurrently on pooled SMTP sessions.
+
+    Parameters
+    ----------
+    config : configuration.Config
+    recipients : list, optional
+        Recipients to mail, defaults to ``EMAIL.recipients``. A retry passes
+        only the recipients a previous attempt did not deliver to
+
+    Returns
+    -------
+    delivered : tuple
+        Recipients the reports were mailed to
+
+    Raises
+    ------
+    DeliveryError
+        When the reports were not delivered to every recipient
+    """
+    from sender import Email, SMTPPool
+
+    email = config.email
+    if recipients is None:
+        recipients = email.recipients
+    attachments = []
+    for name in email.attachments:
+        path = getattr(config.output, name)
+        if os.path.isfile(path):
+            attachments.append(path)
+        else:
+            logging.warning(f'Not attaching {name}, {path} does not exist')
+    messages = (Email(from_=email.sender,
+                      recipients=[recipient],
+                      subject=email.subject,
+                      message=email.message,
+                      attachments=attachments)
+                for recipient in recipients)
+    password = (os.environ.get(email.password_env)
+                if email.password_env else None)
+    logging.info(f'Mailing {attachments} to {len(recipients)} '
+                 f'recipients through {email.host}:{email.port}')
+    with SMTPPool(email.host, email.port,
+                  username=email.username,
+                  password=password,
+                  starttls=email.starttls,
+                  size=email.pool_size) as pool:
+        results = pool.send_many(messages, batch_size=email.batch_size)
+    failed = {recipient: result
+              for recipient, result in zip(recipients, results)
+              if isinstance(result, Exception) or result}
+    delivered = tuple(recipient for recipient in recipients
+                      if recipient not in failed)
+    logging.info(f'Reports mailed to {len(delivered)} recipients')
+    if failed:
+        logging.error(f'Reports not delivered to {failed}')
+        raise DeliveryError(f'Reports not delivered to {len(failed)} of '
+                            f'{len(recipients)} recipients: {failed}',
+                            failed=failed, delivered=delivered)
+    return delivered
@@ -1,13 +1,33 @@
 import os
+import queue
+import re
 import smtplib
 import sys
-from email.encoders import encode_base64
+import threading
+import time
+import uuid
+from base64 import encodebytes
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email import policy
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from email.utils import getaddresses
+from itertools import islice
 from mimetypes import guess_type
 
-from tars.core import Connection
+try:
+    from tars.core import Connection
+except ImportError:
+    # tars only resolves connection parameters for EmailConnection,
+    # SMTPPool works without it
+    Connection = object
+
+CRLF = b"\r\n"
+# raw bytes per read of an attachment, a multiple of the 57 bytes encoded
+# on every 76 character base64 line
+ATTACHMENT_CHUNK_SIZE = 57 * 1024
 
 
 def get_email(email):
@@ -18,6 +38,12 @@ def get_email(email):
 
 
 class Email(object):
+    """
+    Multipart email with a text body and file attachments. Attachments are
+    read and base64 encoded chunk by chunk only while the email is sent,
+    so large workbooks are never held in memory as a whole.
+    """
+
     def __init__(
         self,
         from_,
@@ -29,72 +55,300 @@ def __init__(
         cc=None,
         message_encoding="us-ascii",
     ):
-        self.email = MIMEMultipart()
+        self.boundary = f"==============={uuid.uuid4().hex}=="
+        # SMTP policy, non-ASCII headers are encoded as RFC 2047 words
+        self.email = MIMEMultipart(
+            boundary=self.boundary, policy=policy.SMTP
+        )
         self.email["From"] = from_
         self.email["To"] = ", ".join(recipients)
         self.email["Subject"] = subject
         if cc is not None:
             self.email["Cc"] = cc
-        text = MIMEText(message, message_type, message_encoding)
+        text = MIMEText(
+            message, message_type, message_encoding, policy=policy.SMTP
+        )
         self.email.attach(text)
-        if attachments is not None:
-            for filename in attachments:
-                mimetype, encoding = guess_type(filename)
-                mimetype = mimetype.split("/", 1)
-                fp = open(filename, "rb")
-                attachment = MIMEBase(mimetype[0], mimetype[1])
-                attachment.set_payload(fp.read())
-                fp.close()
-                encode_base64(attachment)
-                attachment.add_header(
-                    "Content-Disposition",
-                    "attachment",
-                    filename=os.path.basename(filename),
-                )
-                self.email.attach(attachment)
+        self.attachments = list(attachments or [])
+        for filename in self.attachments:
+            if not os.path.isfile(filename):
+                raise FileNotFoundError(filename)
+
+    @property
+    def recipients(self):
+        """Addresses of all To and Cc recipients."""
+        fields = self.email.get_all("To", []) + self.email.get_all("Cc", [])
+        return [address for _, address in getaddresses(fields) if address]
+
+    def iter_chunks(self):
+        """
+        Yield the email as CRLF terminated bytes, one attachment chunk at a
+        time.
+        """
+        head = self.email.as_bytes(policy=policy.SMTP)
+        closing = b"--" + self.boundary.encode() + b"--"
+        # body and text part, attachments are streamed before the closing
+        # boundary
+        yield head[: head.rindex(closing)]
+        for filename in self.attachments:
+            mimetype, encoding = guess_type(filename)
+            if mimetype is None or encoding is not None:
+                mimetype = "application/octet-stream"
+            attachment = MIMEBase(*mimetype.split("/", 1))
+            attachment["Content-Transfer-Encoding"] = "base64"
+            attachment.add_header(
+                "Content-Disposition",
+                "attachment",
+                filename=os.path.basename(filename),
+            )
+            yield b"--" + self.boundary.encode() + CRLF + attachment.as_bytes(
+                policy=policy.SMTP
+            )
+            with open(filename, "rb") as fp:
+                for data in iter(lambda: fp.read(ATTACHMENT_CHUNK_SIZE), b""):
+                    yield encodebytes(data).replace(b"\n", CRLF)
+        yield closing + CRLF
 
     def __str__(self):
-        return self.email.as_string()
+        return b"".join(self.iter_chunks()).decode("ascii")
+
+
+def _message_chunks(message):
+    if isinstance(message, Email):
+        return message.iter_chunks()
+    if isinstance(message, str):
+        message = message.encode("ascii")
+    message = re.sub(rb"(?:\r\n|\n|\r(?!\n))", CRLF, message)
+    if not message.endswith(CRLF):
+        message += CRLF
+    return iter([message])
+
+
+def _send_data(session, from_, to, chunks):
+    """
+    MAIL, RCPT and a streamed DATA on an open session, same error handling
+    as ``smtplib.SMTP.sendmail``. Every chunk must end with CRLF.
+
+    Returns
+    -------
+    refused : dict
+        Refused recipients, mapped to the server reply
+    """
+    session.ehlo_or_helo_if_needed()
+    code, response = session.mail(from_)
+    if code != 250:
+        session.rset()
+        raise smtplib.SMTPSenderRefused(code, response, from_)
+    refused = {}
+    for address in to:
+        code, response = session.rcpt(address)
+        if code not in (250, 251):
+            refused[address] = (code, response)
+    if len(refused) == len(to):
+        session.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    code, response = session.docmd("DATA")
+    if code != 354:
+        session.rset()
+        raise smtplib.SMTPDataError(code, response)
+    for chunk in chunks:
+        # lines starting with a period are escaped by doubling it
+        session.send(re.sub(rb"(?m)^\.", b"..", chunk))
+    session.send(b"." + CRLF)
+    code, response = session.getreply()
+    if code != 250:
+        session.rset()
+        raise smtplib.SMTPDataError(code, response)
+    return refused
+
+
+class SMTPPool(object):
+    """
+    Thread-safe pool of authenticated SMTP sessions. Sessions are opened on
+    demand, up to ``size`` at a time, and reused by later sends. A session
+    idle for longer than ``check_after`` seconds is checked with NOOP before
+    it is reused.
+    """
+
+    def __init__(
+        self,
+        host,
+        port=0,
+        username=None,
+        password=None,
+        starttls=True,
+        size=4,
+        timeout=60,
+        check_after=30,
+        smtp_class=smtplib.SMTP,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.smtp_class = smtp_class
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        session = self.smtp_class(self.host, self.port, timeout=self.timeout)
+        session.ehlo()
+        if self.starttls:
+            session.starttls()
+            session.ehlo()
+        if self.username is not None:
+            session.login(self.username, self.password)
+        return session
+
+    @staticmethod
+    def _quit(session):
+        try:
+            session.quit()
+        except OSError:
+            session.close()
+
+    @contextmanager
+    def session(self):
+        """
+        Borrow a session, waiting while ``size`` sessions are in use. Broken
+        sessions are dropped instead of being returned to the pool.
+        """
+        self._slots.acquire()
+        session = None
+        try:
+            try:
+                session, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            else:
+                if time.monotonic() - last_used > self.check_after:
+                    try:
+                        alive = session.noop()[0] == 250
+                    except OSError:
+                        alive = False
+                    if not alive:
+                        self._quit(session)
+                        session = None
+            if session is None:
+                session = self._connect()
+            yield session
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # the server answered and the transaction was reset, the
+            # session can be reused
+            raise
+        except BaseException:
+            if session is not None:
+                session.close()
+                session = None
+            raise
+        finally:
+            if session is not None:
+                self._idle.put((session, time.monotonic()))
+            self._slots.release()
+
+    def send(self, message, from_=None, to=None):
+        """
+        Send an Email, or a raw message string from ``from_`` to ``to``.
+        A send failing on a session the server already dropped is retried
+        once on a new session.
+
+        Returns
+        -------
+        refused : dict
+            Refused recipients, mapped to the server reply
+        """
+        if isinstance(message, Email):
+            from_ = get_email(message.email["From"])
+            to = message.recipients
+        elif from_ is None or to is None:
+            raise ValueError("You need to specify `from_` and `to`")
+        else:
+            from_ = get_email(from_)
+            to = [get_email(to)] if isinstance(to, str) else [
+                get_email(address) for address in to
+            ]
+        for attempt in range(2):
+            try:
+                with self.session() as session:
+                    return _send_data(session, from_, to,
+                                      _message_chunks(message))
+            except smtplib.SMTPServerDisconnected:
+                if attempt:
+                    raise
+
+    def send_many(self, messages, max_workers=None, batch_size=100):
+        """
+        Send messages concurrently on up to ``max_workers`` pooled sessions,
+        ``batch_size`` messages at a time so a long generator of messages
+        is never queued all at once.
+
+        Returns
+        -------
+        results : list
+            Per message, the refused recipients dict or the exception
+            raised while sending it
+        """
+        results = []
+        messages = iter(messages)
+        with ThreadPoolExecutor(max_workers or self.size) as executor:
+            for batch in iter(lambda: list(islice(messages, batch_size)), []):
+                futures = [executor.submit(self.send, message)
+                           for message in batch]
+                for future in futures:
+                    try:
+                        results.append(future.result())
+                    except Exception as exception:
+                        results.append(exception)
+        return results
+
+    def close(self):
+        """Quit every idle session."""
+        while True:
+            try:
+                session, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(session)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 class EmailConnection(Connection):
     _connect_function = smtplib.SMTP
     _CONNECTION_STRING = "{host}:{port}"
 
-    def __init__(self, context: str, params, via="url", **kwargs):
+    def __init__(self, context: str, params, via="url", pool_size=1, **kwargs):
+        if Connection is object:
+            raise ImportError(
+                "EmailConnection needs the tars package, use SMTPPool"
+            )
         super().__init__(context, params, via, **kwargs)
-
-    @property
-    def connection(self):
-        self._connection = self._connect_function(
-            self._CONNECTION_STRING.format(**self._conn_data, **self._conn_kwargs)
+        self.pool = SMTPPool(
+            self._CONNECTION_STRING.format(
+                **self._conn_data, **self._conn_kwargs
+            ),
+            username=self._conn_data.get("username"),
+            password=self._conn_data.get("password"),
+            size=pool_size,
+            smtp_class=self._connect_function,
         )
-        self._connection.ehlo()
-        self._connection.starttls()
-        self._connection.ehlo()
-        self._connection.login(
-            self._conn_data.get("username"), self._conn_data.get("password")
-        )
-        return self._connection
 
     def send(self, message, from_=None, to=None):
-        if type(message) == str:
-            if from_ is None or to is None:
-                raise ValueError("You need to specify `from_` and `to`")
-            else:
-                from_ = get_email(from_)
-                to = get_email(to)
-        else:
-            from_ = message.email["From"]
-            if "Cc" not in message.email:
-                message.email["Cc"] = ""
-            to_emails = [message.email["To"]] + message.email["Cc"].split(",")
-            to = [get_email(complete_email) for complete_email in to_emails]
-            message = str(message)
-        return self.connection.sendmail(from_, to, message)
+        return self.pool.send(message, from_, to)
+
+    def send_many(self, messages, max_workers=None, batch_size=100):
+        return self.pool.send_many(messages, max_workers, batch_size)
 
     def close(self):
-        self.connection.close()
+        self.pool.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,545 @@
+"""
+Local generation service, keeps fitted generators warm in memory and
+serves synthetic rows over HTTP on a TCP port or a Unix socket.
+
+    GET /generate?dataset=<name>&rows=<n>&seed=<s>[&stratum=<name>]
+        streams <n> rows as CSV with chunked transfer encoding
+    GET /datasets
+        configured datasets and the ones currently loaded
+    GET /metrics
+        per-request latency metrics as JSON
+
+Datasets are loaded on first request from their config, fitted once and
+kept in an LRU bounded by ``SERVICE.memory_budget_mb``. The rows of a seed
+do not depend on ``SERVICE.chunk_rows``, and fewer rows of the same seed
+are the first rows of a longer request.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from exceptions import ConfigError
+from smote import ConditionalSmote, select_stratum
+from sources import source_from_config
+
+# rows drawn from one random state, so the rows of a seed do not depend on
+# how they are chunked
+BLOCK_ROWS = 1000
+
+HTTP_STATUS = {200: 'OK',
+               400: 'Bad Request',
+               404: 'Not Found',
+               405: 'Method Not Allowed',
+               500: 'Internal Server Error'}
+
+
+class RequestError(Exception):
+    """
+    Client error, answered with ``status`` and the message.
+
+    Parameters
+    ----------
+    status : int
+        HTTP status code
+    message : str
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def sample_rows(generator, seed, start, stop):
+    """
+    Rows ``start`` to ``stop`` of the synthetic rows of a seed. Rows are
+    drawn in blocks of ``BLOCK_ROWS``, each from a random state seeded with
+    ``(seed, block)``, so any slice of rows is the same however the rows
+    are requested.
+
+    Parameters
+    ----------
+    generator : smote.ConditionalSmote
+    seed : int
+    start, stop : int
+
+    Returns
+    -------
+    rows : pd.DataFrame
+    """
+    blocks = []
+    for block in range(start // BLOCK_ROWS, -(-stop // BLOCK_ROWS)):
+        rows = generator.sample(BLOCK_ROWS,
+                                np.random.RandomState([seed, block]))
+        offset = block * BLOCK_ROWS
+        blocks.append(rows.iloc[max(start - offset, 0):stop - offset])
+    if not blocks:
+        return generator.sample(0, np.random.RandomState(seed))
+    return pd.concat(blocks, ignore_index=True)
+
+
+def dataset_paths(configs):
+    """
+    Dataset name to config file path of every config and of the
+    ``SERVICE.datasets`` of the first config.
+
+    Parameters
+    ----------
+    configs : list
+        List of ``configuration.Config``
+
+    Returns
+    -------
+    datasets : dict
+
+    Raises
+    ------
+    ConfigError
+        When different config files have the same dataset name
+    """
+    datasets = {}
+    errors = []
+    entries = [(config.name, config.path) for config in configs]
+    entries.extend(configs[0].service.datasets.items())
+    for name, path in entries:
+        if datasets.setdefault(name, path) != path:
+            errors.append(f'dataset {name} is configured by both '
+                          f'{datasets[name]} and {path}, set INPUT.name')
+    if errors:
+        raise ConfigError('Duplicate dataset names:\n  '
+                          + '\n  '.join(errors))
+    return datasets
+
+
+class Dataset:
+    """
+    Input DataFrame of a config with generators fitted per stratum.
+
+    Parameters
+    ----------
+    name : str
+    config : configuration.Config
+        Config of the dataset
+    """
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.k_neighbors = config.smote.k_neighbors
+        self.strata = {stratum.get('name', f'stratum_{index}'): stratum
+                       for index, stratum in enumerate(config.smote.strata)}
+        self.df = source_from_config(
+            config.input, config.smote.index_cat_col).read()
+        self.generators = {}
+
+    def generator(self, stratum=None):
+        """
+        Returns the generator of a configured stratum, or of all input rows
+        when no stratum is given. Generators are fitted on first use.
+
+        Parameters
+        ----------
+        stratum : str, optional
+
+        Returns
+        -------
+        generator : ConditionalSmote
+        """
+        if stratum is not None and stratum not in self.strata:
+            raise KeyError(f'Unknown stratum {stratum} for dataset '
+                           f'{self.name}')
+        if stratum not in self.generators:
+            seeds = (self.df if stratum is None
+                     else select_stratum(self.df, self.strata[stratum]))
+            logging.info(f'Fitting generator for {self.name} stratum '
+                         f'{stratum} on {len(seeds)} rows')
+            self.generators[stratum] = ConditionalSmote(
+                self.k_neighbors).fit(seeds)
+        return self.generators[stratum]
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the dataset and its generators."""
+        size = int(self.df.memory_usage(deep=True).sum())
+        for generator in self.generators.values():
+            size += (generator.num_values_.nbytes
+                     + generator.neighbours_.nbytes
+                     + generator.cat_modes_.nbytes)
+        return size
+
+
+class DatasetRegistry:
+    """
+    LRU of loaded datasets bounded by a memory budget. The most recently
+    used dataset is never evicted, even when it alone exceeds the budget.
+
+    Parameters
+    ----------
+    datasets : dict
+        Dataset name to config file path
+    loader : callable
+        Loads a config file path into a ``configuration.Config``
+    memory_budget : int
+        Memory budget in bytes
+    executor : concurrent.futures.Executor
+        Executor used for loading and fitting
+    """
+
+    def __init__(self, datasets, loader, memory_budget, executor):
+        self.datasets = datasets
+        self.loader = loader
+        self.memory_budget = memory_budget
+        self.executor = executor
+        self._loaded = OrderedDict()
+        self._loading = {}
+        self._fitting = {}
+
+    @property
+    def loaded(self):
+        return {name: dataset.nbytes
+                for name, dataset in self._loaded.items()}
+
+    def _load(self, name):
+        start = time.perf_counter()
+        dataset = Dataset(name, self.loader(self.datasets[name]))
+        dataset.generator()
+        logging.info(f'Loaded dataset {name} in '
+                     f'{time.perf_counter() - start:.2f}s, '
+                     f'{dataset.nbytes / 2 ** 20:.1f} MiB')
+        return dataset
+
+    async def get(self, name):
+        """
+        Returns a loaded dataset, loading it if needed. Concurrent requests
+        for a dataset that is being loaded wait for the same load.
+
+        Parameters
+        ----------
+        name : str
+
+        Returns
+        -------
+        dataset : Dataset
+        """
+        if name not in self.datasets:
+            raise KeyError(f'Unknown dataset {name}')
+        if name in self._loaded:
+            self._loaded.move_to_end(name)
+            return self._loaded[name]
+        if name not in self._loading:
+            self._loading[name] = asyncio.get_running_loop().run_in_executor(
+                self.executor, self._load, name)
+        try:
+            dataset = await self._loading[name]
+        finally:
+            self._loading.pop(name, None)
+        self._loaded[name] = dataset
+        self._loaded.move_to_end(name)
+        self.evict()
+        return dataset
+
+    async def generator(self, dataset, stratum=None):
+        """
+        Returns the generator of a dataset stratum, fitting it if needed.
+        Concurrent requests for a stratum that is being fitted wait for the
+        same fit, and datasets are evicted once the fitted generator adds
+        to the memory in use.
+
+        Parameters
+        ----------
+        dataset : Dataset
+        stratum : str, optional
+
+        Returns
+        -------
+        generator : smote.ConditionalSmote
+        """
+        if stratum in dataset.generators:
+            return dataset.generators[stratum]
+        key = (dataset.name, stratum)
+        if key not in self._fitting:
+            self._fitting[key] = asyncio.get_running_loop().run_in_executor(
+                self.executor, dataset.generator, stratum)
+        try:
+            generator = await self._fitting[key]
+        finally:
+            self._fitting.pop(key, None)
+        self.evict()
+        return generator
+
+    def evict(self):
+        """
+        Drop least recently used datasets until the loaded ones fit the
+        memory budget.
+        """
+        total = sum(self.loaded.values())
+        while total > self.memory_budget and len(self._loaded) > 1:
+            name, dataset = self._loaded.popitem(last=False)
+            total -= dataset.nbytes
+            logging.info(f'Evicted dataset {name} from memory')
+
+
+class LatencyMetrics:
+    """
+    Keeps latency of the last ``size`` requests.
+
+    Parameters
+    ----------
+    size : int
+    """
+
+    def __init__(self, size=1000):
+        self.requests = deque(maxlen=size)
+        self.count = 0
+        self.errors = 0
+        self.in_flight = 0
+
+    def record(self, path, status, rows, first_chunk, total):
+        self.count += 1
+        self.errors += status >= 400
+        self.requests.append({'path': path,
+                              'status': status,
+                              'rows': rows,
+                              'first_chunk_s': first_chunk,
+                              'total_s': total})
+
+    def summary(self):
+        totals = np.array([request['total_s'] for request in self.requests])
+        firsts = np.array([request['first_chunk_s']
+                           for request in self.requests
+                           if request['first_chunk_s'] is not None])
+        rows = sum(request['rows'] for request in self.requests)
+        summary = {'count': self.count,
+                   'errors': self.errors,
+                   'in_flight': self.in_flight,
+                   'rows_per_s': (rows / totals.sum()
+                                  if totals.size and totals.sum() else 0.0)}
+        for label, values in (('total_s', totals),
+                              ('first_chunk_s', firsts)):
+            if values.size:
+                summary[label] = {
+                    'p50': float(np.percentile(values, 50)),
+                    'p95': float(np.percentile(values, 95)),
+                    'max': float(values.max())}
+        summary['last'] = list(self.requests)[-10:]
+        return summary
+
+
+class GenerationService:
+    """
+    asyncio HTTP server streaming synthetic rows from warm generators.
+
+    Parameters
+    ----------
+    registry : DatasetRegistry
+    max_concurrency : int
+        Number of generate requests served at a time, others wait
+    chunk_rows : int
+        Number of rows generated and sent per chunk
+    """
+
+    def __init__(self, registry, max_concurrency=4, chunk_rows=10000):
+        self.registry = registry
+        self.chunk_rows = chunk_rows
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.metrics = LatencyMetrics()
+
+    async def handle(self, reader, writer):
+        start = time.perf_counter()
+        path, status, rows, first_chunk = None, 500, 0, None
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            try:
+                method, target, _ = request_line.split(' ', 2)
+            except ValueError:
+                raise RequestError(400, f'Malformed request line '
+                                        f'{request_line!r}')
+            url = urlsplit(target)
+            path = url.path
+            params = {key: values[-1]
+                      for key, values in parse_qs(url.query).items()}
+            if method != 'GET':
+                status = await self.respond_json(writer, 405,
+                                                 {'error': method})
+            elif path == '/generate':
+                status, rows, first_chunk = await self.generate(
+                    writer, params, start)
+            elif path == '/datasets':
+                status = await self.respond_json(
+                    writer, 200,
+                    {'configured': sorted(self.registry.datasets),
+                     'loaded': self.registry.loaded})
+            elif path == '/metrics':
+                status = await self.respond_json(writer, 200,
+                                                 self.metrics.summary())
+            else:
+                status = await self.respond_json(writer, 404,
+                                                 {'error': path})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            logging.warning(f'Client disconnected during {path}')
+        except RequestError as exception:
+            status = await self.respond_json(writer, exception.status,
+                                             {'error': str(exception)})
+        except Exception as exception:
+            logging.exception(f'Request {path} failed')
+            status = await self.respond_json(writer, 500,
+                                             {'error': str(exception)})
+        finally:
+            total = time.perf_counter() - start
+            self.metrics.record(path, status, rows, first_chunk, total)
+            logging.info(f'{path} {status} {rows} rows in {total:.3f}s')
+            writer.close()
+
+    async def generate(self, writer, params, start):
+        """
+        Stream ``rows`` CSV rows of ``dataset``, generated with ``seed``.
+
+        Returns
+        -------
+        status, rows, first_chunk : tuple
+            HTTP status, rows sent and seconds to first chunk
+        """
+        try:
+            n_rows = int(params['rows'])
+            seed = int(params.get('seed', 1234))
+            name = params['dataset']
+        except (KeyError, ValueError) as exception:
+            raise RequestError(400, 'generate needs dataset, integer rows '
+                                    f'and an optional integer seed: '
+                                    f'{exception}')
+        if n_rows < 0:
+            raise RequestError(400, 'rows must not be negative')
+        if name not in self.registry.datasets:
+            raise RequestError(404, f'Unknown dataset {name}')
+        stratum = params.get('stratum')
+
+        async with self.semaphore:
+            self.metrics.in_flight += 1
+            try:
+                loop = asyncio.get_running_loop()
+                # errors loading the dataset are server errors
+                dataset = await self.registry.get(name)
+                if stratum is not None and stratum not in dataset.strata:
+                    raise RequestError(404, f'Unknown stratum {stratum} for '
+                                            f'dataset {name}')
+                generator = await self.registry.generator(dataset, stratum)
+
+                writer.write(self.headers(200, 'text/csv',
+                                          'Transfer-Encoding: chunked'))
+                sent, first_chunk = 0, None
+                try:
+                    while first_chunk is None or sent < n_rows:
+                        size = min(self.chunk_rows, n_rows - sent)
+                        chunk = await loop.run_in_executor(
+                            self.registry.executor, self.encode_chunk,
+                            generator, seed, sent, sent + size)
+                        writer.write(f'{len(chunk):x}\r\n'.encode() + chunk
+                                     + b'\r\n')
+                        await writer.drain()
+                        sent += size
+                        if first_chunk is None:
+                            first_chunk = time.perf_counter() - start
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception:
+                    # the 200 headers are sent, another response would
+                    # corrupt the stream. The connection is closed without
+                    # the last chunk, so clients see the body is incomplete
+                    logging.exception(f'Generating {name} failed after '
+                                      f'{sent} rows')
+                    return 500, sent, first_chunk
+                writer.write(b'0\r\n\r\n')
+                await writer.drain()
+                return 200, sent, first_chunk
+            finally:
+                self.metrics.in_flight -= 1
+
+    @staticmethod
+    def encode_chunk(generator, seed, start, stop):
+        return sample_rows(generator, seed, start, stop).to_csv(
+            index=False, header=start == 0).encode()
+
+    @staticmethod
+    def headers(status, content_type, *extra):
+        lines = [f'HTTP/1.1 {status} {HTTP_STATUS[status]}',
+                 f'Content-Type: {content_type}',
+                 'Connection: close', *extra]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode()
+
+    async def respond_json(self, writer, status, body):
+        content = json.dumps(body, default=str).encode()
+        writer.write(self.headers(status, 'application/json',
+                                  f'Content-Length: {len(content)}')
+                     + content)
+        await writer.drain()
+        return status
+
+    async def start(self, host='127.0.0.1', port=8765, socket=None):
+        """
+        Start listening on a Unix ``socket`` if given, else on
+        ``host``:``port``.
+
+        Returns
+        -------
+        server : asyncio.AbstractServer
+        """
+        if socket is not None:
+            server = await asyncio.start_unix_server(self.handle, socket)
+            logging.info(f'Generation service listening on {socket}')
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            logging.info('Generation service listening on '
+                         f'{server.sockets[0].getsockname()}')
+        return server
+
+
+def serve(configs, loader):
+    """
+    Run the generation service configured in the ``SERVICE`` section of the
+    first config until interrupted.
+
+    Parameters
+    ----------
+    configs : list
+        List of ``configuration.Config``, each served as a dataset
+    loader : callable
+        Loads a config file path into a ``configuration.Config``
+
+    Raises
+    ------
+    ConfigError
+        When several configs have the same dataset name
+    """
+    service_config = configs[0].service
+    datasets = dataset_paths(configs)
+    executor = ThreadPoolExecutor(service_config.workers)
+    registry = DatasetRegistry(
+        datasets, loader,
+        int(service_config.memory_budget_mb * 2 ** 20),
+        executor)
+
+    async def run():
+        service = GenerationService(
+            registry,
+            max_concurrency=service_config.max_concurrency,
+            chunk_rows=service_config.chunk_rows)
+        server = await service.start(service_config.host,
+                                     service_config.port,
+                                     service_config.socket)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        logging.info('Generation service stopped')
+    finally:
+        executor.shutdown()
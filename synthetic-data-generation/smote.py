@@ -1,13 +1,19 @@
 import logging
+from datetime import datetime
 
+import numpy as np
 import pandas as pd
-from imblearn.over_sampling import SMOTENC
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import OneHotEncoder
+from sklearn.utils import check_random_state
+
+from exceptions import EmptyStratumError
 # from sote import SOTENC
 
 
 # TODO: Creating too many pandas objects/dataframes slows the performance
 # FIXME: parametrize this input for y_kmeans
-def custom_smote(df, cat_cols, random_state=1234):
+def custom_smote(df, cat_cols, k_neighbors=6, random_state=1234):
     """
     Creates synthetic DataFrame for a Input DataFrame by splitting dataframe
     to minority and majority using train_test_split by a given percentage.
@@ -21,12 +27,17 @@ def custom_smote(df, cat_cols, random_state=1234):
     df : pd.DataFrame
     cat_cols : list
         List of categorical columns
+    k_neighbors : int
+        Number of nearest neighbours used to construct synthetic samples
     random_state : int
 
     Returns
     -------
     output : pd.DataFrame
     """
+    # imblearn is only needed for whole input oversampling
+    from imblearn.over_sampling import SMOTENC
+
     df_dtypes = df.dtypes.astype('str').to_dict()
     logging.debug("shuffling the data just in case if the datafile "
                   "itself has majority and minority grouped together")
@@ -43,7 +54,7 @@ def custom_smote(df, cat_cols, random_state=1234):
     logging.info("Performing Smote operation on the DataFrame")
     sm = SMOTENC(categorical_features=cat_cols,
                  random_state=random_state,
-                 k_neighbors=6)
+                 k_neighbors=k_neighbors)
     output = sm.fit_sample(df_x, y)
 
     logging.info("Creating DataFrame from synthetic results, "
@@ -54,3 +65,206 @@ def custom_smote(df, cat_cols, random_state=1234):
     output = output[output['__flag_value'] != 0]
     output.drop('__flag_value', inplace=True, axis='columns')
     return output
+
+
+class ConditionalSmote:
+    """
+    SMOTE-NC generator fitted on the seed rows of a single stratum.
+
+    Neighbours are searched only among the seed rows, the same way
+    SMOTENC does for the minority class: numerical columns as they are and
+    categorical columns one-hot encoded, scaled by half the median standard
+    deviation of the numerical columns. Synthetic numerical values are
+    interpolated between a seed row and one of its neighbours, categorical
+    values are the most frequent among the neighbours of the seed row.
+    All neighbour work happens in ``fit``, ``sample`` is linear in the
+    number of requested rows.
+
+    Parameters
+    ----------
+    k_neighbors : int
+        Number of nearest neighbours used to construct synthetic samples
+    random_state : int, RandomState instance or None (default 1234)
+        Default random state for ``sample``
+    """
+
+    def __init__(self, k_neighbors=6, random_state=1234):
+        self.k_neighbors = k_neighbors
+        self.random_state = random_state
+
+    def fit(self, df):
+        """
+        Build the neighbour structure for the seed rows.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Seed rows, categorical columns of dtype ``category``
+
+        Returns
+        -------
+        self : ConditionalSmote
+        """
+        if df.empty:
+            raise EmptyStratumError('Cannot fit generator on empty DataFrame')
+        self.dtypes_ = df.dtypes.to_dict()
+        self.columns_ = list(df.columns)
+        self.cat_cols_ = [column for column, dtype in self.dtypes_.items()
+                          if str(dtype) == 'category']
+        self.num_cols_ = [column for column in self.columns_
+                          if column not in self.cat_cols_]
+        self.categories_ = {column: df[column].cat.categories
+                            for column in self.cat_cols_}
+
+        self.num_values_ = df[self.num_cols_].to_numpy(dtype='float64')
+        cat_codes = np.column_stack(
+            [df[column].cat.codes.to_numpy() for column in self.cat_cols_]
+        ) if self.cat_cols_ else np.empty((len(df), 0), dtype='int64')
+
+        n_seeds = len(df)
+        k_neighbors = min(self.k_neighbors, n_seeds - 1)
+        if k_neighbors < 1:
+            logging.warning('Single seed row, synthetic rows will be copies')
+            self.neighbours_ = np.zeros((n_seeds, 1), dtype='int64')
+            self.cat_modes_ = cat_codes
+            return self
+
+        features = self.num_values_
+        if self.cat_cols_:
+            median_std = (np.median(np.std(self.num_values_, axis=0))
+                          if self.num_cols_ else 1.0)
+            one_hot = OneHotEncoder(categories='auto').fit_transform(
+                cat_codes) * (median_std / 2)
+            features = np.hstack([self.num_values_, one_hot.toarray()])
+        logging.debug(f'Searching {k_neighbors} neighbours of {n_seeds} '
+                      f'seed rows')
+        nn = NearestNeighbors(n_neighbors=k_neighbors + 1).fit(features)
+        self.neighbours_ = nn.kneighbors(features,
+                                         return_distance=False)[:, 1:]
+        self.cat_modes_ = np.column_stack(
+            [_row_mode(cat_codes[self.neighbours_, i],
+                       len(self.categories_[column]))
+             for i, column in enumerate(self.cat_cols_)]
+        ) if self.cat_cols_ else cat_codes
+        return self
+
+    def sample(self, n_rows, random_state=None):
+        """
+        Generate synthetic rows.
+
+        Parameters
+        ----------
+        n_rows : int
+            Number of rows to generate
+        random_state : int, RandomState instance or None
+            Falls back to the random state given to the constructor, pass
+            the same RandomState instance to draw consecutive chunks
+
+        Returns
+        -------
+        output : pd.DataFrame
+        """
+        rng = check_random_state(self.random_state if random_state is None
+                                 else random_state)
+        rows = rng.randint(0, len(self.neighbours_), size=n_rows)
+        neighbours = self.neighbours_[
+            rows, rng.randint(0, self.neighbours_.shape[1], size=n_rows)]
+        steps = rng.uniform(size=(n_rows, 1))
+        base = self.num_values_[rows]
+        num_values = base + steps * (self.num_values_[neighbours] - base)
+
+        output = {}
+        for i, column in enumerate(self.num_cols_):
+            values = num_values[:, i]
+            if str(self.dtypes_[column]).startswith(('int', 'uint')):
+                values = np.rint(values)
+            output[column] = values.astype(self.dtypes_[column])
+        for i, column in enumerate(self.cat_cols_):
+            output[column] = pd.Categorical.from_codes(
+                self.cat_modes_[rows, i], self.categories_[column])
+        return pd.DataFrame(output, columns=self.columns_)
+
+
+def _row_mode(values, n_categories):
+    """
+    Most frequent code of every row, ties resolved to the smallest code.
+    Missing values (code -1) are ignored unless the row has nothing else.
+    """
+    counts = np.zeros((len(values), n_categories + 1), dtype='int64')
+    np.add.at(counts, (np.arange(len(values))[:, None], values + 1), 1)
+    counts[:, 0] = np.where(counts[:, 1:].any(axis=1), 0, 1)
+    return counts.argmax(axis=1) - 1
+
+
+def select_stratum(df, stratum):
+    """
+    Returns the seed rows of a stratum.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+    stratum : dict
+        ``query`` : str, pandas query expression selecting the seed rows, or
+        ``filter`` : callable, taking df and returning a boolean mask.
+        All rows are seeds when neither is given.
+
+    Returns
+    -------
+    seeds : pd.DataFrame
+    """
+    if stratum.get('query'):
+        return df.query(stratum['query'])
+    if stratum.get('filter') is not None:
+        return df[stratum['filter'](df)]
+    return df
+
+
+def conditional_smote(df, strata, k_neighbors=6, random_state=1234):
+    """
+    Creates synthetic DataFrame containing only requested strata. Neighbour
+    structures are built on the seed rows matching each stratum and exactly
+    the requested number of rows is generated for it, so the time per
+    generated row does not depend on how selective the stratum is.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+    strata : list
+        List of dict, each with an optional ``name``, a ``query`` or
+        ``filter`` selecting seed rows (see ``select_stratum``) and
+        ``rows``, the number of synthetic rows to generate, defaults to
+        the number of seed rows
+    k_neighbors : int
+    random_state : int
+
+    Returns
+    -------
+    output : pd.DataFrame
+
+    Examples
+    --------
+    >>> conditional_smote(df, [
+    ...     {'name': 'high_income_female',
+    ...      'query': "income == '>50K' and sex == 'Female'",
+    ...      'rows': 500000}])
+    """
+    rng = check_random_state(random_state)
+    outputs = []
+    for index, stratum in enumerate(strata):
+        name = stratum.get('name', f'stratum_{index}')
+        start = datetime.now()
+        seeds = select_stratum(df, stratum)
+        if seeds.empty:
+            raise EmptyStratumError(f'No input rows match stratum {name}: '
+                                    f'{stratum.get("query", "filter")}')
+        n_rows = int(stratum.get('rows', len(seeds)))
+        logging.info(f'Generating {n_rows} rows for stratum {name} from '
+                     f'{len(seeds)} seed rows')
+        generator = ConditionalSmote(k_neighbors, rng).fit(seeds)
+        outputs.append(generator.sample(n_rows, rng))
+        elapsed = (datetime.now() - start).total_seconds()
+        logging.info(f'Stratum {name} generated in {elapsed:.2f}s, '
+                     f'{elapsed / max(n_rows, 1) * 1e6:.2f}us per row')
+    output = pd.concat(outputs, ignore_index=True)
+    # strata share categories with df, keep the concatenated columns typed
+    return output.astype(df.dtypes.to_dict())
@@ -0,0 +1,404 @@
+"""
+Input sources for Synthetic Data Generation.
+
+Every source reads a table into a DataFrame typed by the
+``SMOTE.index_cat_col`` schema of the config, so the rest of the
+pipeline does not care where the data came from. The source is picked
+by the scheme of the ``INPUT.source`` URI:
+
+    parquet://./tests/testdata/income_level_from_census.parquet
+    arrow://./tests/testdata/income_level_from_census.arrow
+    csv://./tests/testdata/income_level_from_census.csv
+    xlsx://./tests/testdata/income_level_from_census.xlsx
+    sqlite:///./tests/testdata/income_level_from_census.db
+
+Any scheme that is not a file format is handed to SQLAlchemy as a
+database URI.
+"""
+import logging
+import threading
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from exceptions import SourceNotSupportedError
+from utilities import get_cat_codes_df
+
+
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def get_engine(uri):
+    """
+    Returns the SQLAlchemy engine of a database URI. Engines and their
+    connection pools are shared by every source of the process reading
+    the same database.
+
+    Parameters
+    ----------
+    uri : str
+        SQLAlchemy database URI
+
+    Returns
+    -------
+    engine : sqlalchemy.engine.Engine
+    """
+    with _ENGINES_LOCK:
+        if uri not in _ENGINES:
+            from sqlalchemy import create_engine
+            _ENGINES[uri] = create_engine(uri)
+        return _ENGINES[uri]
+
+
+class Source:
+    """
+    Base class for all input sources.
+
+    Parameters
+    ----------
+    location : str
+        File path or database URI of the source
+    dtypes : dict
+        Column name to dtype mapping, ``SMOTE.index_cat_col`` from config
+    drop_cols : list
+        Columns that are not read, or dropped right after reading when
+        the source can not skip them
+    columns : list, optional
+        Columns to read, all columns except ``drop_cols`` by default
+    """
+
+    # keyword options picked from config by ``get_source``
+    options = ()
+
+    def __init__(self, location, dtypes=None, drop_cols=None, columns=None):
+        self.location = location
+        self.dtypes = dict(dtypes or {})
+        self.drop_cols = list(drop_cols or [])
+        self.columns = list(columns) if columns else None
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.location!r})'
+
+    @property
+    def categorical_columns(self):
+        return [column for column, dtype in self.dtypes.items()
+                if str(dtype) == 'category']
+
+    def available_columns(self):
+        """
+        Returns the column names stored in the source, without reading
+        any rows.
+
+        Returns
+        -------
+        columns : list
+        """
+        raise NotImplementedError
+
+    def projection(self):
+        """
+        Returns the column names that need to be read from the source.
+
+        Returns
+        -------
+        columns : list
+        """
+        if self.columns is not None:
+            return self.columns
+        return [column for column in self.available_columns()
+                if column not in self.drop_cols]
+
+    def _read(self, columns):
+        raise NotImplementedError
+
+    def read(self):
+        """
+        Read the source into a DataFrame cast to the configured dtypes.
+
+        Returns
+        -------
+        df : pd.DataFrame
+        """
+        logging.info(f'Reading {self}')
+        df = self._read(self.projection())
+        dropped = [column for column in self.drop_cols
+                   if column in df.columns]
+        if dropped:
+            logging.warning(f'Dropping columns {dropped} from DataFrame')
+            df.drop(dropped, axis='columns', inplace=True)
+        return df.astype({column: dtype
+                          for column, dtype in self.dtypes.items()
+                          if column in df.columns})
+
+    def read_codes(self):
+        """
+        Read the source into an encoded DataFrame, categorical columns
+        replaced by their numeric codes.
+
+        Returns
+        -------
+        df_cat_codes : pd.DataFrame
+        """
+        return get_cat_codes_df(self.read())
+
+
+class SqlSource(Source):
+    """
+    Reads a SQL query or database table through SQLAlchemy.
+
+    Parameters
+    ----------
+    sql : str
+        SQL query to be executed or a table name
+    """
+
+    options = ('sql',)
+
+    def __init__(self, location, sql=None, **kwargs):
+        super().__init__(location, **kwargs)
+        if sql is None:
+            raise ValueError(f'SQL source {location} needs a `sql` query '
+                             'or table name')
+        self.sql = sql
+        self._engine = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = get_engine(self.location)
+        return self._engine
+
+    def available_columns(self):
+        from sqlalchemy import inspect, text
+        if self.is_table:
+            return [column['name']
+                    for column in inspect(self.engine).get_columns(self.sql)]
+        # only the cursor description is needed, the wrapped query returns
+        # no rows so drivers with client side cursors do not buffer any
+        with self.engine.connect() as connection:
+            result = connection.execute(text(self.subquery(where='1 = 0')))
+            try:
+                return list(result.keys())
+            finally:
+                result.close()
+
+    def projection(self):
+        # the query decides which columns come back, drop_cols are removed
+        # after reading
+        return self.columns
+
+    @property
+    def is_table(self):
+        return len(self.sql.split()) == 1
+
+    def subquery(self, select='*', where=''):
+        """
+        Wrap the query as a subquery, so the database only computes the
+        selected columns or rows.
+
+        Parameters
+        ----------
+        select : str
+            Select list of the outer query
+        where : str
+            Optional where clause of the outer query
+
+        Returns
+        -------
+        sql : str
+        """
+        sql = f'SELECT {select} FROM ({self.sql.strip().rstrip(";")}) AS q'
+        return f'{sql} WHERE {where}' if where else sql
+
+    def _read(self, columns):
+        logging.info(f'Generating DataFrame from sql, executing query '
+                     f'{self.sql}; on db {self.location}')
+        if columns is None or self.is_table:
+            # read_sql projects table reads by itself
+            return pd.read_sql(self.sql, self.engine, columns=columns)
+        quote = self.engine.dialect.identifier_preparer.quote
+        logging.info(f'Projecting query result to columns {columns}')
+        return pd.read_sql(
+            self.subquery(', '.join(quote(column) for column in columns)),
+            self.engine)
+
+
+class ParquetSource(Source):
+    """
+    Reads a Parquet file memory-mapped, only the projected columns are
+    read and categorical columns are decoded straight to pandas
+    categoricals.
+    """
+
+    def available_columns(self):
+        import pyarrow.parquet as pq
+        return [column
+                for column in pq.ParquetFile(self.location,
+                                             memory_map=True).schema.names
+                if not column.startswith('__index_level_')]
+
+    def _read(self, columns):
+        import pyarrow.parquet as pq
+        table = pq.read_table(
+            self.location, columns=columns, memory_map=True,
+            read_dictionary=[column for column in self.categorical_columns
+                             if column in columns])
+        return table.to_pandas()
+
+
+class ArrowSource(Source):
+    """
+    Reads an Arrow IPC (Feather v2) file memory-mapped, only the
+    projected columns are converted to pandas.
+    """
+
+    def available_columns(self):
+        import pyarrow as pa
+        with pa.memory_map(self.location) as stream:
+            return pa.ipc.open_file(stream).schema.names
+
+    def _read(self, columns):
+        from pyarrow import feather
+        table = feather.read_table(self.location, columns=columns,
+                                   memory_map=True)
+        return table.to_pandas()
+
+
+class CsvSource(Source):
+    """
+    Reads a CSV file, optionally in chunks of ``chunksize`` rows so
+    categorical columns are compacted as the file is read.
+
+    Parameters
+    ----------
+    chunksize : int, optional
+        Number of rows per chunk, the whole file is read at once by default
+    """
+
+    options = ('chunksize',)
+
+    def __init__(self, location, chunksize=None, **kwargs):
+        super().__init__(location, **kwargs)
+        self.chunksize = chunksize
+
+    def available_columns(self):
+        return list(pd.read_csv(self.location, nrows=0).columns)
+
+    def _read(self, columns):
+        reader = pd.read_csv(self.location, usecols=columns,
+                             dtype={column: dtype
+                                    for column, dtype in self.dtypes.items()
+                                    if column in columns},
+                             chunksize=self.chunksize)
+        if self.chunksize is None:
+            return reader
+        return concat_chunks(list(reader))
+
+
+class ExcelSource(Source):
+    """
+    Reads the first sheet of an Excel workbook.
+    """
+
+    def available_columns(self):
+        return list(pd.read_excel(self.location, nrows=0).columns)
+
+    def _read(self, columns):
+        return pd.read_excel(self.location, usecols=columns)
+
+
+SOURCES = {'parquet': ParquetSource,
+           'arrow': ArrowSource,
+           'feather': ArrowSource,
+           'csv': CsvSource,
+           'xlsx': ExcelSource}
+
+
+def concat_chunks(chunks):
+    """
+    Concatenate DataFrame chunks, keeping categorical columns categorical
+    even when the chunks saw different categories.
+
+    Parameters
+    ----------
+    chunks : list
+        List of pd.DataFrame with the same columns
+
+    Returns
+    -------
+    df : pd.DataFrame
+    """
+    if not chunks:
+        return pd.DataFrame()
+    df = pd.concat(chunks, ignore_index=True)
+    for column, dtype in chunks[0].dtypes.to_dict().items():
+        if str(dtype) == 'category':
+            # sorted like the categories of a single read_csv
+            df[column] = union_categoricals([chunk[column]
+                                             for chunk in chunks],
+                                            sort_categories=True)
+    return df
+
+
+def get_source(uri, dtypes=None, drop_cols=None, columns=None, **options):
+    """
+    Returns the Source for a given URI, picked by the URI scheme.
+
+    Parameters
+    ----------
+    uri : str
+        ``<scheme>://<path>`` for files, SQLAlchemy URI for databases
+    dtypes : dict
+        Column name to dtype mapping
+    drop_cols : list
+        Columns to leave out of the DataFrame
+    columns : list, optional
+        Columns to read
+    options :
+        Source specific keywords, i.e. ``sql`` or ``chunksize``, options
+        the chosen source does not take are ignored
+
+    Returns
+    -------
+    source : Source
+    """
+    scheme, separator, path = uri.partition('://')
+    if not separator:
+        raise SourceNotSupportedError(
+            f'Input source {uri} is not a URI, expecting <scheme>://<path>')
+    scheme = scheme.lower()
+    if scheme in SOURCES:
+        source_class, location = SOURCES[scheme], path
+    else:
+        source_class, location = SqlSource, uri
+    return source_class(location,
+                        dtypes=dtypes,
+                        drop_cols=drop_cols,
+                        columns=columns,
+                        **{key: value for key, value in options.items()
+                           if key in source_class.options
+                           and value is not None})
+
+
+def source_from_config(input_config, dtypes):
+    """
+    Returns the input Source configured in the ``INPUT`` section.
+
+    Parameters
+    ----------
+    input_config : configuration.InputConfig
+        ``INPUT`` section of config
+    dtypes : dict
+        ``SMOTE.index_cat_col`` section of config
+
+    Returns
+    -------
+    source : Source
+    """
+    return get_source(input_config.source,
+                      dtypes=dtypes,
+                      drop_cols=input_config.drop_cols,
+                      columns=input_config.columns,
+                      sql=input_config.sql,
+                      chunksize=input_config.chunksize)
@@ -2,6 +2,28 @@
 import pandas as pd
 
 
+def get_cat_codes_df(df):
+    """
+    Returns DataFrame containing only categorical columns
+    converted into numeric code, used for clustering
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+
+    Returns
+    -------
+    df_cat_codes : pd.DataFrame
+    """
+    df_cat_codes = pd.DataFrame()
+    for column, dtype in df.dtypes.to_dict().items():
+        if str(dtype) == 'category':
+            df_cat_codes[column] = df[column].cat.codes
+        elif str(dtype).startswith('int'):
+            df_cat_codes[column] = df[column]
+    return df_cat_codes
+
+
 def save_to_excel(dataframes, images,
                        output_xlsx):
     """
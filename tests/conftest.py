@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'synthetic-data-generation'))
+
+from configuration import load_config  # noqa: E402
+from sources import get_source  # noqa: E402
+
+TESTS = os.path.join(ROOT, 'tests')
+CENSUS_DB = os.path.join(TESTS, 'testdata',
+                         'income_level_from_census.db')
+
+
+@pytest.fixture(scope='session')
+def config():
+    """tests/config.yaml"""
+    return load_config(os.path.join(TESTS, 'config.yaml'))
+
+
+@pytest.fixture(scope='session')
+def census_source(config):
+    """SQL source of the census test data, typed as in tests/config.yaml."""
+    return get_source(f'sqlite:///{CENSUS_DB}',
+                      dtypes=config.smote.index_cat_col,
+                      drop_cols=config.input.drop_cols,
+                      sql=config.input.sql)
+
+
+@pytest.fixture(scope='session')
+def census(census_source):
+    """Sample of 4000 census rows, keep it small so tests stay fast."""
+    return census_source.read().sample(4000, random_state=0).reset_index(
+        drop=True)
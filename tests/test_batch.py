@@ -0,0 +1,188 @@
+import csv
+import logging
+import os
+import sys
+import time
+
+import pytest
+import yaml
+
+import batch
+from configuration import load_manifest
+from conftest import CENSUS_DB
+from exceptions import ConfigError, DeliveryError
+
+STRATUM = {'name': 'female_over_60', 'query': "sex == 'Female' and age > 60",
+           'rows': 50}
+
+
+def write_config(directory, name, config, strata=(STRATUM,), **sections):
+    output = directory / name
+    output.mkdir()
+    path = directory / f'{name}.yaml'
+    path.write_text(yaml.safe_dump({
+        **sections,
+        'INPUT': {'source': f'sqlite:///{CENSUS_DB}',
+                  'sql': config.input.sql,
+                  'drop_cols': list(config.input.drop_cols),
+                  'name': name},
+        'OUTPUT': {'output_path': str(output)},
+        'REPORTS': {'db_metadata': False, 'cluster': False,
+                    'statistics': False},
+        'CLUSTER': {'X': list(config.cluster.X)},
+        'SMOTE': {'index_cat_col': config.smote.index_cat_col,
+                  'strata': list(strata)}}))
+    return str(path)
+
+
+def write_manifest(directory, configs, **batch_options):
+    path = directory / 'manifest.yaml'
+    path.write_text(yaml.safe_dump({
+        'BATCH': {'output_path': str(directory), 'workers': 2,
+                  **batch_options},
+        'CONFIGS': configs}))
+    return str(path)
+
+
+def read_summary(manifest):
+    with open(manifest.batch.summary, newline='') as stream:
+        return list(csv.DictReader(stream))
+
+
+def test_run_batch(tmp_path, config, caplog):
+    # as configure_logging does for real runs
+    caplog.set_level(logging.INFO)
+    paths = [write_config(tmp_path, name, config)
+             for name in ('first', 'second')]
+    manifest = load_manifest(write_manifest(tmp_path, paths))
+    jobs = batch.run_batch(manifest)
+
+    assert [job.failed for job in jobs] == [False, False]
+    rows = read_summary(manifest)
+    assert sorted((row['config'], row['stage'], row['attempt'],
+                   row['status']) for row in rows) == sorted(
+        (path, stage, '1', 'done') for path in paths
+        for stage in ('load', 'generate', 'report'))
+    for row in rows:
+        assert float(row['finished_s']) >= float(row['submitted_s'])
+        assert float(row['run_s']) >= 0 and row['error'] == ''
+    for name in ('first', 'second'):
+        assert os.path.isfile(tmp_path / name / 'synth_results.xlsx')
+        with open(tmp_path / name / 'log.out') as stream:
+            log = stream.read()
+        # every stage logs to the job log, loading in a thread included
+        for stage in ('load', 'generate', 'report'):
+            assert f'Running {stage} of' in log
+        assert 'Dropping columns' in log
+
+
+def test_failed_stage_retried(tmp_path, config):
+    paths = [write_config(tmp_path, 'good', config),
+             write_config(tmp_path, 'empty', config,
+                          [{'name': 'nobody', 'query': 'age > 1000'}])]
+    manifest = load_manifest(write_manifest(tmp_path, paths, retries=2))
+    good, empty = batch.run_batch(manifest)
+
+    assert not good.failed
+    assert empty.failed
+    assert empty.attempts['generate'] == 3
+    rows = [row for row in read_summary(manifest)
+            if row['config'] == paths[1]]
+    assert [(row['stage'], row['attempt'], row['status']) for row in rows] \
+        == [('load', '1', 'done'), ('generate', '1', 'failed'),
+            ('generate', '2', 'failed'), ('generate', '3', 'failed')]
+    assert all('EmptyStratumError' in row['error'] for row in rows[1:])
+
+
+def crash_or_run(stage, config, *args):
+    """Worker stage crashing the worker process for the ``crash`` job."""
+    if stage == 'generate':
+        if config.name == 'crash':
+            time.sleep(0.5)
+            os._exit(1)
+        time.sleep(2)
+    return batch._run_stage(stage, config, *args)
+
+
+def test_crash_not_charged_to_other_jobs(tmp_path, config, monkeypatch):
+    # workers import this module to run crash_or_run
+    monkeypatch.setattr(batch, '_run_stage', crash_or_run)
+    paths = [write_config(tmp_path, name, config)
+             for name in ('first', 'crash', 'second')]
+    manifest = load_manifest(write_manifest(tmp_path, paths, workers=3,
+                                            retries=1))
+    first, crash, second = batch.run_batch(manifest)
+
+    assert crash.failed
+    assert crash.attempts['generate'] == 2
+    for job in (first, second):
+        assert not job.failed
+        assert job.attempts['generate'] == 1
+        statuses = [timing['status'] for timing in job.timings
+                    if timing['stage'] == 'generate']
+        assert statuses[-1] == 'done'
+        assert set(statuses) <= {'interrupted', 'done'}
+    assert [timing['status'] for timing in crash.timings
+            if timing['stage'] == 'generate'] == \
+        ['interrupted', 'failed', 'failed']
+
+
+def test_notify_retried_for_undelivered_recipients(tmp_path, config,
+                                                   monkeypatch):
+    mailed = []
+
+    def notify_stage(config, recipients):
+        # flaky@ is refused once, refused@ every time
+        failed = {recipient: (550, b'No such user')
+                  for recipient in recipients
+                  if recipient == 'refused@example.com'
+                  or (recipient == 'flaky@example.com' and not mailed)}
+        mailed.append(list(recipients))
+        if failed:
+            raise DeliveryError('Reports not delivered', failed=failed,
+                                delivered=[recipient
+                                           for recipient in recipients
+                                           if recipient not in failed])
+        return tuple(recipients)
+
+    monkeypatch.setattr(batch.pipeline, 'notify_stage', notify_stage)
+    recipients = ['ok@example.com', 'flaky@example.com',
+                  'refused@example.com']
+    path = write_config(tmp_path, 'mailed', config,
+                        EMAIL={'host': 'localhost',
+                               'sender': 'reports@example.com',
+                               'recipients': recipients})
+    manifest = load_manifest(write_manifest(tmp_path, [path], retries=2))
+    [job] = batch.run_batch(manifest)
+
+    assert job.failed
+    # nobody is mailed twice, only refused@ is tried on every attempt
+    assert mailed == [recipients,
+                      ['flaky@example.com', 'refused@example.com'],
+                      ['refused@example.com']]
+    assert [row['status'] for row in read_summary(manifest)
+            if row['stage'] == 'notify'] == ['failed'] * 3
+
+
+@pytest.mark.parametrize('batch_options, message', [
+    ({'retries': -1}, 'BATCH.retries: must not be negative'),
+    ({'memory_limit_mb': 0}, 'BATCH.memory_limit_mb: must be positive'),
+    ({'workers': 'two'}, 'BATCH.workers: expecting int'),
+])
+def test_invalid_manifest(tmp_path, batch_options, message):
+    with pytest.raises(ConfigError, match=message):
+        load_manifest(write_manifest(tmp_path, ['config.yaml'],
+                                     **batch_options))
+
+
+def test_manifest_needs_configs(tmp_path):
+    with pytest.raises(ConfigError, match='CONFIGS: expecting at least one'):
+        load_manifest(write_manifest(tmp_path, []))
+
+
+def test_memory_limit_without_resource(tmp_path, monkeypatch):
+    # as on Windows
+    monkeypatch.setitem(sys.modules, 'resource', None)
+    with pytest.raises(ConfigError, match='not supported on this platform'):
+        load_manifest(write_manifest(tmp_path, ['config.yaml'],
+                                     memory_limit_mb=4096))
@@ -0,0 +1,119 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import event
+
+from configuration import parse_config, validate_schema
+from conftest import CENSUS_DB, ROOT
+from exceptions import ConfigError
+from sources import get_source
+
+MINIMAL = '''
+VARS:
+  base_dir: &base_dir {base_dir}
+  db_dir: &db_dir 'sqlite:///{base_dir}'
+INPUT:
+  source: !join [*db_dir, 'income_level_from_census.db']
+  sql: {sql}
+OUTPUT:
+  output_path: !join [*base_dir, 'reports']
+CLUSTER:
+  X: [{x}]
+SMOTE:
+  index_cat_col: {{'age': 'int64', 'income': 'category'}}
+'''
+
+
+def minimal_config(tmp_path, sql='income_level_from_census',
+                   x="'age', 'hours.per.week'", extra=''):
+    content = MINIMAL.format(base_dir=os.path.dirname(CENSUS_DB), sql=sql,
+                             x=x) + extra
+    path = tmp_path / 'config.yaml'
+    path.write_text(content)
+    return str(path), parse_config(content, str(path))
+
+
+def test_vars_anchors(tmp_path):
+    _, config = minimal_config(tmp_path)
+    assert config.input.source == f'sqlite:///{CENSUS_DB}'
+    assert config.output.log_file == os.path.join(
+        os.path.dirname(CENSUS_DB), 'reports', 'log.out')
+
+
+def test_errors_reported_together(tmp_path):
+    with pytest.raises(ConfigError) as error:
+        minimal_config(tmp_path, x="'age'",
+                       extra="  k_neighbors: 'six'\nEXTRA: {}\n")
+    message = str(error.value)
+    assert 'CLUSTER.X: expecting at least two columns' in message
+    assert 'SMOTE.k_neighbors: expecting int' in message
+    assert 'EXTRA: unknown section' in message
+
+
+def test_unknown_input_key(tmp_path):
+    content = MINIMAL.format(base_dir='.', sql='t', x="'a', 'b'").replace(
+        '  sql:', '  input_db: x.db\n  sql:')
+    with pytest.raises(ConfigError, match='INPUT.input_db: unknown key'):
+        parse_config(content, 'config.yaml')
+
+
+def test_validate_schema_query_reads_no_rows(tmp_path):
+    _, config = minimal_config(
+        tmp_path, sql='"select age, income, \\"hours.per.week\\" '
+                      'from income_level_from_census"')
+    source = get_source(config.input.source, sql=config.input.sql,
+                        dtypes=config.smote.index_cat_col)
+    statements = []
+    event.listen(source.engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args:
+                 statements.append(statement))
+    validate_schema(config, source)
+    assert len(statements) == 1
+    assert statements[0].endswith('WHERE 1 = 0')
+
+
+def test_validate_schema_missing_column(tmp_path):
+    _, config = minimal_config(tmp_path, x="'age', 'height'")
+    source = get_source(config.input.source, sql=config.input.sql)
+    with pytest.raises(ConfigError, match='CLUSTER.X: column height'):
+        validate_schema(config, source)
+
+
+def test_validate_schema_missing_input_column(tmp_path):
+    _, config = minimal_config(tmp_path)
+    source = get_source(config.input.source, sql=config.input.sql,
+                        columns=['age', 'hours.per.week', 'incme'])
+    with pytest.raises(ConfigError) as error:
+        validate_schema(config, source)
+    message = str(error.value)
+    assert 'INPUT.columns: column incme' in message
+    # index_cat_col has income, which is not in the projection
+    assert 'SMOTE.index_cat_col: column income' in message
+
+
+def test_validate_schema_unreadable_source(tmp_path):
+    _, config = minimal_config(tmp_path, sql='missing_table')
+    source = get_source(config.input.source, sql=config.input.sql)
+    with pytest.raises(ConfigError, match='INPUT.source: can not read'):
+        validate_schema(config, source)
+
+
+@pytest.mark.parametrize('source', ['not a uri',
+                                    'csv:///missing/census.csv'])
+def test_serve_validates_sources(tmp_path, source):
+    path, _ = minimal_config(tmp_path)
+    with open(path) as stream:
+        content = stream.read()
+    with open(path, 'w') as stream:
+        stream.write(content.replace(
+            "!join [*db_dir, 'income_level_from_census.db']",
+            repr(source)))
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'synthetic-data-generation'),
+         '-c', path, '--serve'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, timeout=60)
+    assert result.returncode == 1
+    assert 'Error:' in result.stderr
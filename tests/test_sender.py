@@ -0,0 +1,287 @@
+import email
+import email.policy
+import os
+import smtplib
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import types
+
+import pytest
+import yaml
+
+from configuration import EmailConfig
+from conftest import CENSUS_DB, ROOT
+from exceptions import DeliveryError
+from pipeline import notify_stage
+from sender import Email, SMTPPool
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP server session, enough for smtplib."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.sessions.append(self.connection)
+        self.reply('220 localhost ready')
+        mail_from, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            address = command.partition(':')[2].strip().strip('<>')
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                mail_from, recipients = address, []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                if 'refused' in address:
+                    self.reply('550 No such user')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data in iter(self.rfile.readline, b''):
+                    if data == b'.\r\n':
+                        break
+                    lines.append(data)
+                self.server.messages.append({
+                    'from': mail_from,
+                    'to': recipients,
+                    'raw': b''.join(lines),
+                    # remove the dot stuffing of the client
+                    'data': b''.join(data[1:] if data.startswith(b'.')
+                                     else data for data in lines)})
+                self.reply('250 OK queued')
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.sessions = []
+        self.messages = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def drop_sessions(self):
+        """Close every open session, as a server timing out idle clients."""
+        for connection in self.sessions:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+@pytest.fixture
+def server():
+    server = SMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def pool(server):
+    with SMTPPool('127.0.0.1', server.port, starttls=False, size=2) as pool:
+        yield pool
+
+
+@pytest.fixture
+def attachment(tmp_path):
+    path = tmp_path / 'synth_summary.xlsx'
+    path.write_bytes(os.urandom(3 * 2 ** 20 + 17))
+    return str(path)
+
+
+def test_send_many_reuses_sessions(server, pool):
+    messages = [Email('Reports <reports@example.com>',
+                      [f'user{index}@example.com'], f'Report {index}',
+                      'Reports attached')
+                for index in range(10)]
+    results = pool.send_many(messages, batch_size=4)
+    assert results == [{}] * 10
+    assert len(server.sessions) <= 2
+    assert sorted(message['to'][0] for message in server.messages) == \
+        sorted(f'user{index}@example.com' for index in range(10))
+    assert {message['from'] for message in server.messages} == \
+        {'reports@example.com'}
+
+
+def test_dot_stuffing(server, pool, tmp_path):
+    text = 'first\n.\n.hidden\n..two\nlast'
+    dots = tmp_path / 'dots.txt'
+    dots.write_text('.\n.dot\n')
+    pool.send(Email('a@example.com', ['b@example.com'], 'Dots', text,
+                    attachments=[str(dots)]))
+    pool.send('Subject: raw\n\n.line\n.', 'a@example.com', 'b@example.com')
+    first, raw = server.messages
+    assert b'\r\n..\r\n..hidden\r\n...two\r\n' in first['raw']
+    body, attached = email.message_from_bytes(first['data']).get_payload()
+    assert body.get_payload().replace('\r\n', '\n') == text
+    assert attached.get_payload(decode=True) == b'.\n.dot\n'
+    assert raw['data'] == b'Subject: raw\r\n\r\n.line\r\n.\r\n'
+
+
+def test_large_attachment_round_trip(server, pool, attachment):
+    pool.send(Email('a@example.com', ['b@example.com'], 'Large',
+                    'Reports attached', attachments=[attachment]))
+    message = email.message_from_bytes(server.messages[0]['data'])
+    body, attached = message.get_payload()
+    assert attached.get_filename() == 'synth_summary.xlsx'
+    with open(attachment, 'rb') as stream:
+        assert attached.get_payload(decode=True) == stream.read()
+
+
+def test_refused_recipient(server, pool):
+    refused = pool.send(Email('a@example.com',
+                              ['ok@example.com', 'refused@example.com'],
+                              'Partly refused', 'text'))
+    assert list(refused) == ['refused@example.com']
+    assert refused['refused@example.com'][0] == 550
+    assert server.messages[0]['to'] == ['ok@example.com']
+
+    results = pool.send_many([Email('a@example.com', ['refused@example.com'],
+                                    'Refused', 'text')])
+    assert isinstance(results[0], smtplib.SMTPRecipientsRefused)
+    # the server answered, the session is kept for the next send
+    assert pool.send('Subject: next\n\ntext', 'a@example.com',
+                     'ok@example.com') == {}
+    assert len(server.sessions) == 1
+
+
+def test_dropped_session_retried_once(server, pool):
+    pool.send('Subject: first\n\ntext', 'a@example.com', 'b@example.com')
+    server.drop_sessions()
+    assert pool.send('Subject: second\n\ntext', 'a@example.com',
+                     'b@example.com') == {}
+    assert len(server.sessions) == 2
+    assert len(server.messages) == 2
+
+
+def test_send_many_keeps_results_of_failed_messages(server, pool):
+    messages = [Email('a@example.com', ['b@example.com'], 'first', 'text'),
+                # raw messages are ASCII only
+                'Subject: café\n\ntext',
+                Email('Zoë <a@example.com>', ['b@example.com'], 'café',
+                      'café', message_encoding='utf-8')]
+    results = pool.send_many(messages)
+    assert results[0] == {} and results[2] == {}
+    assert isinstance(results[1], ValueError)
+    assert len(server.messages) == 2
+    received = [email.message_from_bytes(message['data'],
+                                         policy=email.policy.default)
+                for message in server.messages]
+    message, = [message for message in received
+                if message['Subject'] == 'café']
+    assert message['From'] == 'Zoë <a@example.com>'
+    assert message.get_payload()[0].get_content() == 'café'
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def notify_config(tmp_path, port, recipients):
+    output = types.SimpleNamespace(summary_excel=str(tmp_path / 'a.xlsx'),
+                                   synth_summary_excel=str(tmp_path /
+                                                           'b.xlsx'))
+    for path in vars(output).values():
+        with open(path, 'wb') as stream:
+            stream.write(b'report')
+    return types.SimpleNamespace(
+        output=output,
+        email=EmailConfig(host='127.0.0.1', port=port, starttls=False,
+                          sender='reports@example.com',
+                          recipients=tuple(recipients)))
+
+
+def test_notify_stage(server, tmp_path):
+    notify_stage(notify_config(tmp_path, server.port,
+                               ['a@example.com', 'b@example.com']))
+    assert sorted(message['to'][0] for message in server.messages) == \
+        ['a@example.com', 'b@example.com']
+
+
+@pytest.mark.parametrize('recipients', [['refused@example.com'],
+                                        ['a@example.com',
+                                         'refused@example.com']])
+def test_notify_stage_refused(server, tmp_path, recipients):
+    with pytest.raises(DeliveryError, match='refused@example.com'):
+        notify_stage(notify_config(tmp_path, server.port, recipients))
+
+
+def test_notify_stage_partly_delivered(server, tmp_path):
+    config = notify_config(tmp_path, server.port,
+                           ['a@example.com', 'refused@example.com',
+                            'b@example.com'])
+    with pytest.raises(DeliveryError) as error:
+        notify_stage(config)
+    assert list(error.value.failed) == ['refused@example.com']
+    assert error.value.delivered == ('a@example.com', 'b@example.com')
+
+    # a retry mails only the recipients given
+    server.messages.clear()
+    assert notify_stage(config, ['b@example.com']) == ('b@example.com',)
+    assert [message['to'] for message in server.messages] == \
+        [['b@example.com']]
+
+
+def test_notify_stage_unreachable(tmp_path):
+    with pytest.raises(DeliveryError, match='ConnectionRefusedError'):
+        notify_stage(notify_config(tmp_path, closed_port(),
+                                   ['a@example.com']))
+
+
+def test_cli_reports_delivery_error(server, tmp_path, config):
+    path = tmp_path / 'config.yaml'
+    path.write_text(yaml.safe_dump({
+        'INPUT': {'source': f'sqlite:///{CENSUS_DB}',
+                  'sql': config.input.sql,
+                  'drop_cols': list(config.input.drop_cols)},
+        'OUTPUT': {'output_path': str(tmp_path)},
+        'REPORTS': {'db_metadata': False, 'cluster': False,
+                    'statistics': False},
+        'CLUSTER': {'X': list(config.cluster.X)},
+        'SMOTE': {'index_cat_col': config.smote.index_cat_col,
+                  'strata': [{'name': 'female_over_60',
+                              'query': "sex == 'Female' and age > 60",
+                              'rows': 50}]},
+        'EMAIL': {'host': '127.0.0.1', 'port': server.port,
+                  'starttls': False, 'sender': 'reports@example.com',
+                  'recipients': ['a@example.com', 'refused@example.com']}}))
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'synthetic-data-generation'),
+         '-c', str(path)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, timeout=120)
+    assert result.returncode == 1
+    assert 'Error:' in result.stderr
+    assert 'refused@example.com' in result.stderr
+    assert 'Traceback' not in result.stderr
+    assert [message['to'] for message in server.messages] == \
+        [['a@example.com']]
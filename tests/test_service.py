@@ -0,0 +1,294 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import yaml
+
+from configuration import load_config
+from exceptions import ConfigError
+from service import DatasetRegistry, GenerationService, dataset_paths
+
+
+def write_config(directory, name, source, dtypes, **input_options):
+    path = directory / f'{name}.yaml'
+    path.write_text(yaml.safe_dump({
+        'INPUT': {'source': source, 'name': name, **input_options},
+        'OUTPUT': {'output_path': str(directory)},
+        'CLUSTER': {'X': ['age', 'hours.per.week']},
+        'SMOTE': {'index_cat_col': dtypes,
+                  'k_neighbors': 5,
+                  'strata': [{'name': 'female',
+                              'query': "sex == 'Female'"}]}}))
+    return str(path)
+
+
+@pytest.fixture
+def datasets(tmp_path, census, config):
+    csv = tmp_path / 'census.csv'
+    census.head(500).to_csv(csv, index=False)
+    return {name: write_config(tmp_path, name, f'csv://{csv}',
+                               config.smote.index_cat_col)
+            for name in ('census', 'other')}
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(4)
+    yield executor
+    executor.shutdown()
+
+
+def make_service(datasets, executor, memory_budget=2 ** 30, **kwargs):
+    registry = DatasetRegistry(datasets, load_config, memory_budget,
+                               executor)
+    return GenerationService(registry, **kwargs)
+
+
+def run_service(service, scenario):
+    """Run ``scenario(port)`` against the service listening on any port."""
+    async def main():
+        server = await service.start(port=0)
+        async with server:
+            return await scenario(server.sockets[0].getsockname()[1])
+    return asyncio.run(main())
+
+
+async def request(port, target, method='GET'):
+    """
+    Returns status, body and whether a chunked body was complete.
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'{method} {target} HTTP/1.1\r\nHost: test\r\n\r\n'
+                 .encode())
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    head, _, body = data.partition(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    if b'Transfer-Encoding: chunked' not in head:
+        return status, body, True
+    chunks = []
+    while body:
+        size, _, body = body.partition(b'\r\n')
+        size = int(size, 16)
+        if size == 0:
+            return status, b''.join(chunks), True
+        chunks.append(body[:size])
+        body = body[size + 2:]
+    return status, b''.join(chunks), False
+
+
+def test_generate_rows(datasets, executor):
+    service = make_service(datasets, executor, chunk_rows=100)
+
+    async def scenario(port):
+        return [await request(port, f'/generate?dataset=census&rows={rows}'
+                                    f'&seed=3&stratum={stratum}')
+                for rows, stratum in ((250, ''), (250, 'female'), (0, ''))]
+
+    results = run_service(service, scenario)
+    for (status, body, complete), rows in zip(results, (250, 250, 0)):
+        assert status == 200 and complete
+        lines = body.decode().splitlines()
+        assert len(lines) == rows + 1
+        assert lines[0].split(',') == list(
+            service.registry._loaded['census'].df.columns)
+    female = results[1][1].decode().splitlines()
+    sex = female[0].split(',').index('sex')
+    assert {line.split(',')[sex] for line in female[1:]} == {'Female'}
+
+
+def test_same_seed_same_bytes(datasets, executor):
+    service = make_service(datasets, executor, chunk_rows=64)
+
+    async def scenario(port):
+        return [await request(port, f'/generate?dataset=census&rows=300'
+                                    f'&seed={seed}')
+                for seed in (11, 11, 12)]
+
+    first, second, other = run_service(service, scenario)
+    assert first[1] == second[1]
+    assert first[1] != other[1]
+
+
+def test_rows_independent_of_chunking(datasets, executor):
+    def generate(chunk_rows, rows, stratum=''):
+        service = make_service(datasets, executor, chunk_rows=chunk_rows)
+
+        async def scenario(port):
+            return await request(port, f'/generate?dataset=census'
+                                       f'&rows={rows}&seed=42'
+                                       f'&stratum={stratum}')
+
+        status, body, complete = run_service(service, scenario)
+        assert status == 200 and complete
+        return body.decode().splitlines()
+
+    rows = generate(1000, 2500)
+    assert generate(100, 2500) == rows
+    assert generate(333, 2500) == rows
+    assert generate(1000, 500) == rows[:501]
+    assert generate(64, 1234) == rows[:1235]
+    female = generate(700, 1500, 'female')
+    assert generate(10000, 900, 'female') == female[:901]
+
+
+@pytest.mark.parametrize('target, method, status', [
+    ('/generate?dataset=missing&rows=10', 'GET', 404),
+    ('/generate?dataset=census&rows=10&stratum=missing', 'GET', 404),
+    ('/generate?dataset=census&rows=ten', 'GET', 400),
+    ('/generate?dataset=census&rows=-1', 'GET', 400),
+    ('/generate?dataset=census', 'GET', 400),
+    ('/generate?dataset=census&rows=10', 'POST', 405),
+    ('/missing', 'GET', 404),
+    ('/generate?dataset=broken&rows=10', 'GET', 500),
+    ('/generate?dataset=bad_column&rows=10', 'GET', 500),
+])
+def test_status_codes(datasets, executor, tmp_path, config, target, method,
+                      status):
+    # errors loading a dataset are server errors, not bad requests
+    broken = tmp_path / 'broken.yaml'
+    broken.write_text('INPUT: {source: 1}\n')
+    bad_column = write_config(tmp_path, 'bad_column',
+                              f'csv://{tmp_path / "census.csv"}',
+                              config.smote.index_cat_col,
+                              columns=['age', 'missing'])
+    datasets = {**datasets, 'broken': str(broken),
+                'bad_column': bad_column}
+    service = make_service(datasets, executor)
+
+    async def scenario(port):
+        return await request(port, target, method)
+
+    response_status, body, _ = run_service(service, scenario)
+    assert response_status == status
+    assert 'error' in json.loads(body)
+
+
+def test_semaphore_caps_in_flight(datasets, executor):
+    service = make_service(datasets, executor, max_concurrency=2,
+                           chunk_rows=50)
+    observed = []
+
+    def encode_chunk(*args):
+        observed.append(service.metrics.in_flight)
+        return GenerationService.encode_chunk(*args)
+
+    service.encode_chunk = encode_chunk
+
+    async def scenario(port):
+        return await asyncio.gather(*[
+            request(port, f'/generate?dataset=census&rows=500&seed={seed}')
+            for seed in range(6)])
+
+    results = run_service(service, scenario)
+    assert [status for status, _, _ in results] == [200] * 6
+    assert max(observed) == 2
+    assert service.metrics.in_flight == 0
+
+
+def test_lru_eviction(datasets, executor):
+    service = make_service(datasets, executor, memory_budget=1)
+
+    async def scenario(port):
+        await request(port, '/generate?dataset=census&rows=10')
+        await request(port, '/generate?dataset=other&rows=10')
+        return json.loads((await request(port, '/datasets'))[1])
+
+    listing = run_service(service, scenario)
+    assert listing['configured'] == ['census', 'other']
+    assert list(listing['loaded']) == ['other']
+
+
+def test_fitted_stratum_evicts(datasets, executor):
+    service = make_service(datasets, executor)
+    registry = service.registry
+
+    async def scenario(port):
+        await request(port, '/generate?dataset=census&rows=10')
+        await request(port, '/generate?dataset=other&rows=10')
+        # both fit until a stratum is fitted for other
+        registry.memory_budget = sum(registry.loaded.values())
+        await request(port, '/generate?dataset=other&rows=10&stratum=female')
+        return registry.loaded
+
+    assert list(run_service(service, scenario)) == ['other']
+
+
+def test_concurrent_stratum_fitted_once(datasets, executor, monkeypatch):
+    service = make_service(datasets, executor)
+    fits = []
+
+    async def scenario(port):
+        await request(port, '/generate?dataset=census&rows=10')
+        dataset = service.registry._loaded['census']
+        generator = dataset.generator
+
+        def counted(stratum=None):
+            fits.append(stratum)
+            return generator(stratum)
+
+        monkeypatch.setattr(dataset, 'generator', counted)
+        return await asyncio.gather(*[
+            request(port, '/generate?dataset=census&rows=10&stratum=female')
+            for _ in range(4)])
+
+    results = run_service(service, scenario)
+    assert [status for status, _, _ in results] == [200] * 4
+    assert fits == ['female']
+
+
+def test_failure_mid_stream(datasets, executor):
+    service = make_service(datasets, executor, chunk_rows=10)
+    calls = []
+
+    def encode_chunk(*args):
+        calls.append(args)
+        if len(calls) > 1:
+            raise RuntimeError('generator failed')
+        return GenerationService.encode_chunk(*args)
+
+    service.encode_chunk = encode_chunk
+
+    async def scenario(port):
+        return await request(port, '/generate?dataset=census&rows=100')
+
+    status, body, complete = run_service(service, scenario)
+    assert status == 200
+    assert not complete
+    assert b'HTTP/1.1' not in body
+    assert len(body.decode().splitlines()) == 11
+    assert service.metrics.requests[-1]['status'] == 500
+
+
+def test_metrics(datasets, executor):
+    service = make_service(datasets, executor)
+
+    async def scenario(port):
+        await request(port, '/generate?dataset=census&rows=20')
+        await request(port, '/generate?dataset=census&rows=30')
+        await request(port, '/generate?dataset=missing&rows=30')
+        return json.loads((await request(port, '/metrics'))[1])
+
+    metrics = run_service(service, scenario)
+    assert metrics['count'] == 3
+    assert metrics['errors'] == 1
+    assert metrics['in_flight'] == 0
+    assert [request['rows'] for request in metrics['last']] == [20, 30, 0]
+    assert metrics['total_s']['max'] >= metrics['total_s']['p50']
+
+
+def test_duplicate_dataset_names(datasets, tmp_path):
+    census = load_config(datasets['census'])
+    other_dir = tmp_path / 'other'
+    other_dir.mkdir()
+    same_name = load_config(write_config(other_dir, 'census',
+                                         census.input.source,
+                                         census.smote.index_cat_col))
+    assert dataset_paths([census, census]) == {'census': census.path}
+    with pytest.raises(ConfigError, match='dataset census'):
+        dataset_paths([census, same_name])
+    renamed = same_name._replace(
+        input=same_name.input._replace(name='census_2'))
+    assert list(dataset_paths([census, renamed])) == ['census', 'census_2']
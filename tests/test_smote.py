@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+from exceptions import EmptyStratumError
+from smote import conditional_smote
+
+STRATA = [{'name': 'older_high_income_female',
+           'query': "income == '>50K' and sex == 'Female' and age >= 40",
+           'rows': 500},
+          {'name': 'low_income_part_time',
+           'query': "income == '<=50K' and `hours.per.week` < 40",
+           'rows': 123}]
+
+
+@pytest.fixture(scope='module')
+def synth_df(census):
+    return conditional_smote(census, STRATA, k_neighbors=6)
+
+
+def test_rows_per_stratum(synth_df):
+    assert len(synth_df) == sum(stratum['rows'] for stratum in STRATA)
+    for stratum in STRATA:
+        assert len(synth_df.query(stratum['query'])) == stratum['rows']
+
+
+def test_rows_satisfy_query(synth_df):
+    matching = pd.concat([synth_df.query(stratum['query'])
+                          for stratum in STRATA])
+    assert len(matching) == len(synth_df)
+
+
+def test_dtypes_preserved(census, synth_df):
+    assert synth_df.dtypes.to_dict() == census.dtypes.to_dict()
+    for column in census.select_dtypes('category'):
+        assert list(synth_df[column].cat.categories) == \
+            list(census[column].cat.categories)
+
+
+def test_rows_default_to_seed_count(census):
+    stratum = {'query': "sex == 'Female' and age >= 60"}
+    synth_df = conditional_smote(census, [stratum])
+    assert len(synth_df) == len(census.query(stratum['query']))
+
+
+def test_same_random_state_same_rows(census):
+    first = conditional_smote(census, STRATA, random_state=7)
+    second = conditional_smote(census, STRATA, random_state=7)
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_empty_stratum(census):
+    with pytest.raises(EmptyStratumError):
+        conditional_smote(census, [{'name': 'nobody',
+                                    'query': 'age > 1000',
+                                    'rows': 10}])
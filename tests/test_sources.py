@@ -0,0 +1,121 @@
+import pandas as pd
+import pytest
+
+from exceptions import SourceNotSupportedError
+from sources import (ArrowSource, CsvSource, ExcelSource, ParquetSource,
+                     SqlSource, concat_chunks, get_source)
+
+PROJECTION = ['age', 'workclass', 'hours.per.week', 'income']
+
+
+def assert_frame_equal(left, right, **kwargs):
+    # exact comparison is much faster on categorical columns
+    pd.testing.assert_frame_equal(left, right, check_exact=True, **kwargs)
+
+
+def observed(df):
+    """Categorical columns with only the categories in use."""
+    return df.apply(lambda column: column.cat.remove_unused_categories()
+                    if str(column.dtype) == 'category' else column)
+
+
+@pytest.fixture(scope='module')
+def expected(census_source):
+    return census_source.read()
+
+
+@pytest.fixture(scope='module')
+def files(tmp_path_factory, expected):
+    directory = tmp_path_factory.mktemp('sources')
+    files = {'parquet': directory / 'census.parquet',
+             'feather': directory / 'census.feather',
+             'csv': directory / 'census.csv',
+             'xlsx': directory / 'census.xlsx'}
+    expected.to_parquet(files['parquet'], index=False)
+    expected.to_feather(files['feather'])
+    expected.to_csv(files['csv'], index=False)
+    # excel is slow to write, a slice is enough
+    expected.head(200).to_excel(files['xlsx'], index=False)
+    return files
+
+
+def make_source(files, census_source, scheme, **options):
+    return get_source(f'{scheme}://{files[scheme]}',
+                      dtypes=census_source.dtypes,
+                      drop_cols=census_source.drop_cols, **options)
+
+
+@pytest.mark.parametrize('scheme, source_class', [
+    ('parquet', ParquetSource),
+    ('feather', ArrowSource),
+    ('csv', CsvSource),
+])
+def test_read_equals_sql(files, census_source, expected, scheme,
+                         source_class):
+    source = make_source(files, census_source, scheme)
+    assert isinstance(source, source_class)
+    df = source.read()
+    assert_frame_equal(df, expected)
+
+
+def test_excel_read_equals_sql(files, census_source, expected):
+    source = make_source(files, census_source, 'xlsx')
+    assert isinstance(source, ExcelSource)
+    # the slice only has some of the categories
+    assert_frame_equal(source.read(), observed(expected.head(200)))
+
+
+@pytest.mark.parametrize('chunksize', [1000, 7777, 10 ** 6])
+def test_chunked_csv(files, census_source, expected, chunksize):
+    source = make_source(files, census_source, 'csv', chunksize=chunksize)
+    assert_frame_equal(source.read(), expected)
+
+
+def test_concat_chunks_unions_categories():
+    chunks = [pd.DataFrame({'x': pd.Categorical(['b', 'c'])}),
+              pd.DataFrame({'x': pd.Categorical(['a', 'b'])})]
+    df = concat_chunks(chunks)
+    assert str(df['x'].dtype) == 'category'
+    assert list(df['x']) == ['b', 'c', 'a', 'b']
+    assert list(df['x'].cat.categories) == ['a', 'b', 'c']
+    assert concat_chunks([]).empty
+
+
+@pytest.mark.parametrize('scheme', ['parquet', 'feather', 'csv', 'xlsx'])
+def test_projected_read(files, census_source, expected, scheme):
+    source = make_source(files, census_source, scheme, columns=PROJECTION)
+    assert source.available_columns()[:2] == ['age', 'workclass']
+    df = source.read()
+    assert list(df.columns) == PROJECTION
+    expected = expected[PROJECTION].head(len(df))
+    assert_frame_equal(df, observed(expected) if scheme == 'xlsx'
+                       else expected)
+
+
+@pytest.mark.parametrize('sql', [
+    'income_level_from_census',
+    'select * from income_level_from_census'])
+def test_projected_sql_read(census_source, expected, sql):
+    source = get_source(census_source.location, sql=sql,
+                        dtypes=census_source.dtypes, columns=PROJECTION)
+    assert_frame_equal(source.read(), expected[PROJECTION])
+
+
+def test_get_source_by_scheme(census_source):
+    assert type(get_source('PARQUET://x.parquet')) is ParquetSource
+    assert type(get_source('arrow://x.arrow')) is ArrowSource
+    source = get_source('sqlite:///x.db', sql='t', chunksize=10)
+    assert type(source) is SqlSource and source.location == 'sqlite:///x.db'
+    # options other sources take are ignored
+    assert get_source('csv://x.csv', sql='t', chunksize=10).chunksize == 10
+
+
+@pytest.mark.parametrize('uri', ['census.csv', '/data/census.parquet'])
+def test_not_a_uri(uri):
+    with pytest.raises(SourceNotSupportedError):
+        get_source(uri)
+
+
+def test_sql_source_needs_sql():
+    with pytest.raises(ValueError):
+        get_source('sqlite:///x.db')